@@ -1,310 +1,474 @@
 import streamlit as st
-import requests
 import pandas as pd
-import json
+import numpy as np
+import os
+import threading
 import time
+from datetime import datetime
+
+from core import (
+    DEPTH_DEADLINE, PipelinedRefresh, apply_live_prices, build_arb_frame, calculate_arb_capacity_batch,
+    get_book_cache, get_catalog_store, get_metrics, get_scheduler, get_spread_history, get_stream_manager,
+    record_spread_history, scan_arbitrage,
+)
 
 st.set_page_config(page_title="Polymarket vs Probable 市场对比", page_icon="📊", layout="wide")
 
 st.title("Polymarket vs Probable 相同市场名称对比工具")
 st.markdown("显示名称完全相同的市场，并附带双边价格、流动性与成交量对比")
 
-# ==========================================
-# 🔐 关键配置：伪装成浏览器 (User-Agent)
-# ==========================================
-HEADERS = {
-    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-    "Accept": "application/json",
-    "Referer": "https://probable.markets/",
-    "Origin": "https://probable.markets"
-}
-
 # --- 0. 初始化 Session State ---
 if 'stats_poly_count' not in st.session_state: st.session_state['stats_poly_count'] = 0
 if 'stats_prob_count' not in st.session_state: st.session_state['stats_prob_count'] = 0
 if 'stats_match_count' not in st.session_state: st.session_state['stats_match_count'] = 0
-if 'depth_cache' not in st.session_state: st.session_state['depth_cache'] = {}
-
-# ==========================================
-# 📊 顶部常驻仪表盘
-# ==========================================
-with st.container(border=True):
-    col_m1, col_m2, col_m3 = st.columns(3)
-    col_m1.metric("🔵 Polymarket 活跃市场", st.session_state['stats_poly_count'])
-    col_m2.metric("🟠 Probable 活跃市场", st.session_state['stats_prob_count'])
-    col_m3.metric("🔗 匹配成功", st.session_state['stats_match_count'])
 
 # --- 辅助函数 ---
-def safe_float(val):
-    try:
-        if val is None or val == "": return 0.0
-        return float(val)
-    except: return 0.0
-
 def clear_selection():
     st.session_state["market_select"] = None
 
-def parse_outcomes(outcomes_str):
-    default = ["Yes", "No"]
-    if not outcomes_str: return default
-    try:
-        if isinstance(outcomes_str, str):
-            data = json.loads(outcomes_str)
-            if isinstance(data, list) and len(data) >= 2: return data
-        elif isinstance(outcomes_str, list) and len(outcomes_str) >= 2:
-            return outcomes_str
-    except: pass
-    return default
-
-# --- 1. 获取 Polymarket 数据 ---
-@st.cache_data(ttl=60)
-def get_poly_markets():
-    url = "https://gamma-api.polymarket.com/markets"
-    params = {"active": "true", "closed": "false", "limit": 500}
-    markets = []
-    offset = 0
-    try:
-        while True:
-            resp = requests.get(url, params={**params, "offset": offset}, headers=HEADERS, timeout=10)
-            if resp.status_code != 200: break 
-            data = resp.json()
-            if not data: break
-            markets.extend(data)
-            offset += 500
-    except Exception as e:
-        st.error(f"Polymarket 数据拉取失败: {e}")
-    return markets
-
-# --- 2. 获取 Probable 市场列表 ---
-@st.cache_data(ttl=60)
-def get_probable_markets():
-    url = "https://market-api.probable.markets/public/api/v1/markets/"
-    markets = []
-    page = 1
-    try:
-        while True:
-            resp = requests.get(url, params={"page": page, "limit": 100, "active": "true"}, headers=HEADERS, timeout=10)
-            if resp.status_code != 200: break
-            data = resp.json()
-            new = data.get("markets", []) 
-            if not new: break
-            markets.extend(new)
-            page += 1
-    except Exception as e:
-        st.error(f"Probable 列表拉取失败: {e}")
-    return markets
-
-# --- 3. 批量获取 Probable 价格 ---
-def get_probable_prices_batch(token_ids):
-    if not token_ids: return {}
-    url = "https://api.probable.markets/public/api/v1/prices"
-    results = {}
-    chunk_size = 50
-    for i in range(0, len(token_ids), chunk_size):
-        chunk = token_ids[i:i+chunk_size]
-        payload = [{"token_id": t, "side": "BUY"} for t in chunk]
+def render_diagnostics():
+    """本进程的埋点：各阶段耗时、各接口请求分布、被吞掉的异常"""
+    snap = get_metrics().snapshot()
+    if not snap["stages"] and not snap["endpoints"]:
+        st.caption("本进程尚未发起请求")
+        return
+    if snap["stages"]:
+        st.markdown("**⏱️ 各阶段耗时**")
+        st.dataframe(pd.DataFrame([{
+            "阶段": s["stage"], "最近 (s)": s["last"], "次数": s["count"],
+            "p50 (s)": s["quantiles"][0.5], "p95 (s)": s["quantiles"][0.95], "p99 (s)": s["quantiles"][0.99],
+        } for s in snap["stages"]]).round(3), hide_index=True, use_container_width=True)
+    if snap["endpoints"]:
+        st.markdown("**🌐 接口请求**")
+        st.dataframe(pd.DataFrame([{
+            "接口": e["endpoint"], "请求数": e["count"],
+            "状态码": " ".join(f"{code}×{n}" for code, n in sorted(e["statuses"].items())),
+            "p50 (ms)": e["quantiles"][0.5] * 1000, "p95 (ms)": e["quantiles"][0.95] * 1000,
+            "p99 (ms)": e["quantiles"][0.99] * 1000, "流量 (KB)": e["bytes"] / 1024,
+        } for e in snap["endpoints"]]).round(1), hide_index=True, use_container_width=True)
+    limits = get_scheduler().stats()
+    if limits:
+        st.markdown("**🚦 限流状态**")
+        st.dataframe(pd.DataFrame([{
+            "Host": h["host"], "当前速率 (req/s)": h["rate"], "上限 (req/s)": h["max_rate"],
+            "429 次数": h["throttled"], "重试次数": h["retries"], "暂停剩余 (s)": h["paused_for"],
+        } for h in limits]).round(1), hide_index=True, use_container_width=True)
+    if snap["exceptions"]:
+        st.markdown("**⚠️ 已捕获的异常**")
+        st.dataframe(pd.DataFrame([{
+            "位置": x["where"], "类型": x["type"], "次数": x["count"], "最近一条": x["last"],
+        } for x in snap["exceptions"]]), hide_index=True, use_container_width=True)
+    st.download_button(
+        "⬇️ 导出 Prometheus 指标", get_metrics().prometheus_text(),
+        file_name="arb_metrics.prom", mime="text/plain",
+    )
+
+# --- 核心逻辑 ---
+MASTER_COLUMNS = ["市场名称", "Polymarket 价格", "Probable 价格", "Poly 流动性", "Poly 24h 量", "Prob 流动性", "Prob 24h 量", "匹配"]
+# 原生列格式由前端渲染 (只作用于当前页)，不再对整张表生成 Styler
+MASTER_COLUMN_CONFIG = {
+    "市场名称": st.column_config.TextColumn("市场名称", width="large"),
+    "Polymarket 价格": st.column_config.TextColumn("🔵 Polymarket 价格"),
+    "Probable 价格": st.column_config.TextColumn("🟠 Probable 价格"),
+    "Poly 流动性": st.column_config.NumberColumn("🔵 流动性 ($)", format="dollar"),
+    "Poly 24h 量": st.column_config.NumberColumn("🔵 24h 量 ($)", format="dollar"),
+    "Prob 流动性": st.column_config.NumberColumn("🟠 流动性 ($)", format="dollar"),
+    "Prob 24h 量": st.column_config.NumberColumn("🟠 24h 量 ($)", format="dollar"),
+    "匹配": st.column_config.TextColumn("匹配", help="空白为名称相同；🔀 为模糊匹配 (分数)，确认前不参与套利扫描"),
+}
+TABLE_PAGE_SIZE = 100
+HISTORY_WINDOWS = {"1 小时": 3600, "6 小时": 6 * 3600, "24 小时": 24 * 3600, "7 天": 7 * 24 * 3600}
+HISTORY_BUCKETS = 240      # 价差历史图的点数 (库内降采样)
+AUTO_REFRESH_OPTIONS = [0, 5, 15, 30, 60]   # 套利面板自动刷新间隔 (秒)，0 为关闭
+# 后台刷新 (stale-while-revalidate)：快照到达 SNAPSHOT_MAX_AGE 的 REFRESH_AHEAD 比例时在后台重取，
+# 页面始终立即显示上一份完好的快照；失败后 REFRESH_RETRY 秒再试，期间继续使用旧数据
+SNAPSHOT_MAX_AGE = float(os.environ.get("ARB_SNAPSHOT_MAX_AGE", "60"))
+REFRESH_AHEAD = 0.75
+REFRESH_RETRY = 30
+REFRESH_TICK = 5            # 后台线程检查间隔，也是页面刷新数据年龄的间隔 (秒)
+REFRESH_IDLE = 600          # 超过该时间没有任何会话访问时暂停后台刷新 (秒)
+
+def apply_snapshot(snap):
+    """把快照写入当前会话 (对比表、套利数据与顶部计数)"""
+    st.session_state['stats_poly_count'] = snap["stats"]["poly"]
+    st.session_state['stats_prob_count'] = snap["stats"]["prob"]
+    st.session_state['stats_match_count'] = snap["stats"]["match"]
+    st.session_state['stats_fuzzy_count'] = snap["stats"].get("fuzzy", 0)
+    # 旧快照的行没有匹配列
+    rows = [row + [""] * (len(MASTER_COLUMNS) - len(row)) for row in snap["rows"]]
+    st.session_state.master_df = pd.DataFrame(rows, columns=MASTER_COLUMNS) if rows else pd.DataFrame()
+    st.session_state.fuzzy_pairs = snap["stats"].get("fuzzy_pairs") or []
+    # 搜索索引 (选项列表 + 名称 -> 行号)：每份快照只构建一次，不在每次重跑时扫描整列
+    st.session_state.market_options = [row[0] for row in snap["rows"]]
+    st.session_state.market_index = {name: i for i, name in enumerate(st.session_state.market_options)}
+    st.session_state.arb_frame = build_arb_frame(snap["arb"])
+    st.session_state.arb_changes = snap.get("changes") or []
+    st.session_state['stats_changed_count'] = snap["stats"].get("changed")
+    # 后台扫描进程发布的卖盘预热进程内盘口缓存 (仍按 TTL 过期)
+    get_book_cache().prime(snap.get("depth") or {}, snap.get("created_at", time.time()))
+    st.session_state['snapshot_at'] = snap.get("created_at", time.time())
+
+def publish_snapshot(snap, errors):
+    """流水线刷新完成时在后台线程调用：发布快照并写入价差历史；目录全部拉取失败时 snap 为 None，保留上一份"""
+    if snap is None: return
+    snap["created_at"] = get_catalog_store().save_snapshot(snap["rows"], snap["arb"], snap["stats"], changes=snap["changes"])
+    record_spread_history(snap["created_at"], snap["updated"])
+
+def start_refresh(state=None):
+    """进程内同一时间只跑一个流水线刷新，多个会话 (及后台刷新线程) 共享它的进度与结果"""
+    state = state or get_background_state()
+    with state["lock"]:
+        if state["refresh"] is None or state["refresh"].done.is_set():
+            state["refresh"] = PipelinedRefresh(get_catalog_store(), on_done=publish_snapshot).start()
+        return state["refresh"]
+
+def revalidate(state):
+    """快照接近过期时在后台重取；扫描进程在运行时由它负责刷新。返回是否发起了刷新"""
+    store = get_catalog_store()
+    created_at = store.snapshot_created_at()
+    # 还没有快照 (首次抓取由用户发起) 或长时间无人访问时不刷新
+    if created_at is None or time.time() - state["last_seen"] > REFRESH_IDLE: return False
+    if store.scanner_alive(): return False
+    with state["lock"]:
+        last = state["refresh"]
+    if last is not None and not last.done.is_set(): return False
+    # 上次刷新失败 (快照未替换)：退避一段时间再试
+    if last is not None and last.snap is None and time.time() - last.started_at < REFRESH_RETRY: return False
+    if time.time() - created_at < SNAPSHOT_MAX_AGE * REFRESH_AHEAD: return False
+    start_refresh(state)
+    return True
+
+def refresh_loop(state):
+    while True:
+        time.sleep(REFRESH_TICK)
         try:
-            resp = requests.post(url, json=payload, headers=HEADERS, timeout=5)
-            if resp.status_code == 200:
-                results.update(resp.json())
+            revalidate(state)
         except Exception as e:
-            pass
-    return results
-
-# --- 4. 真实深度计算函数 (返回详细数据) ---
-def calculate_arb_capacity(poly_id, prob_id):
-    cache_key = f"{poly_id}_{prob_id}"
-    if cache_key in st.session_state['depth_cache']:
-        return st.session_state['depth_cache'][cache_key]
-
-    capacity_poly = 0.0
-    capacity_prob = 0.0
-    
-    # 1. Polymarket Best Ask
-    try:
-        url = f"https://clob.polymarket.com/book?token_id={poly_id}"
-        resp = requests.get(url, headers=HEADERS, timeout=3)
-        if resp.status_code == 200:
-            asks = resp.json().get("asks", [])
-            if asks:
-                best_ask = asks[0]
-                price = float(best_ask["price"])
-                size = float(best_ask["size"])
-                # 过滤掉 0 价格
-                if price > 0.005: capacity_poly = price * size
-    except: pass
-
-    # 2. Probable Best Ask
-    try:
-        url = f"https://api.probable.markets/public/api/v1/book?token_id={prob_id}"
-        resp = requests.get(url, headers=HEADERS, timeout=3)
-        if resp.status_code == 200:
-            asks = resp.json().get("asks", [])
-            if asks:
-                best_ask = asks[0]
-                price = float(best_ask[0])
-                size = float(best_ask[1])
-                # 过滤掉 0 价格
-                if price > 0.005: capacity_prob = price * size
-    except: pass
-    
-    # 返回三元组 (总容量, Poly端, Prob端)
-    result = (min(capacity_poly, capacity_prob), capacity_poly, capacity_prob)
-    
-    st.session_state['depth_cache'][cache_key] = result
-    return result
+            get_metrics().record_exception("background_refresh", e)
+
+@st.cache_resource
+def get_background_state():
+    state = {"refresh": None, "lock": threading.Lock(), "last_seen": time.time()}
+    # 进程内唯一的后台刷新线程；状态直接传入，线程里不调用 Streamlit 缓存函数
+    threading.Thread(target=refresh_loop, args=(state,), name="snapshot-refresher", daemon=True).start()
+    return state
+
+@st.fragment(run_every=REFRESH_TICK)
+def render_snapshot_age(scanner_alive):
+    """数据时间与年龄：定时只重跑本片段；发现新快照 (后台刷新或扫描进程发布) 时整页重跑换上新数据"""
+    if (get_catalog_store().snapshot_created_at() or 0) > st.session_state.get('snapshot_at', 0):
+        st.rerun()
+    if 'snapshot_at' not in st.session_state: return
+    age = time.time() - st.session_state['snapshot_at']
+    source = " · 🛰️ 由后台扫描进程发布" if scanner_alive else ""
+    changed = st.session_state.get('stats_changed_count')
+    delta = f" · 本轮变化 {changed} 个市场" if changed is not None else ""
+    refresh = get_background_state()["refresh"]
+    if scanner_alive:
+        freshness = ""
+    elif refresh is not None and not refresh.done.is_set():
+        freshness = " · 🔄 后台刷新中"
+    elif age > SNAPSHOT_MAX_AGE:
+        freshness = " · ⏳ 已过期，等待后台刷新"
+    else:
+        freshness = ""
+    st.caption(
+        f"🕒 数据时间: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(st.session_state['snapshot_at']))} "
+        f"({age:.0f}s 前){freshness}{source}{delta}"
+    )
+    # 刷新失败 (含任一目录拉取失败) 时快照不会被替换，页面继续显示上一份数据
+    if not scanner_alive and refresh is not None and refresh.done.is_set() and (refresh.snap is None or refresh.errors):
+        reason = "；".join(refresh.errors) or "未知错误"
+        st.caption(f"⚠️ {time.strftime('%H:%M:%S', time.localtime(refresh.started_at))} 的后台刷新失败 ({reason})，继续显示上一份数据")
 
-# --- 核心逻辑 ---
 def load_and_process_data():
-    st.session_state['depth_cache'] = {} 
+    """等待流水线刷新完成；途中已定价的行实时显示，不必等整份目录下载完"""
     status_text = st.empty()
     progress_bar = st.progress(0)
-    
+    preview = st.empty()
+    refresh = start_refresh()
+    rows, cursor = {}, 0
+
     try:
-        status_text.text("Step 1/4: 扫描 Polymarket...")
-        poly = get_poly_markets()
-        st.session_state['stats_poly_count'] = len(poly)
-        progress_bar.progress(25)
-        
-        status_text.text("Step 2/4: 扫描 Probable...")
-        prob = get_probable_markets()
-        st.session_state['stats_prob_count'] = len(prob)
-        progress_bar.progress(50)
-
-        poly_dict = {m["question"].strip().lower(): m for m in poly if "question" in m}
-        prob_dict = {m["question"].strip().lower(): m for m in prob if "question" in m}
-        common_questions = sorted(set(poly_dict.keys()) & set(prob_dict.keys()))
-        
-        st.session_state['stats_match_count'] = len(common_questions)
-
-        if not common_questions:
+        while not refresh.done.wait(0.3):
+            new_rows, cursor = refresh.rows_since(cursor)
+            rows.update(new_rows)
+            p = refresh.progress()
+            if p["catalogs_done"]:
+                status_text.text(f"Step 3/3: 完整匹配 (含模糊匹配) 并生成对比表... 已出表 {len(rows)} 个市场")
+                progress_bar.progress(90)
+            else:
+                status_text.text(
+                    f"Step 1-2/3: 边抓取边匹配 · Polymarket {p['poly_pages']} 页 / Probable {p['prob_pages']} 页 · "
+                    f"已配对 {p['matched']} · 已出表 {len(rows)} · {p['elapsed']:.1f}s"
+                )
+                progress_bar.progress(min(80, int(80 * p["priced"] / max(p["matched"], 1))))
+            if new_rows:
+                # 最近定价的一页行
+                preview.dataframe(
+                    pd.DataFrame(list(rows.values())[-TABLE_PAGE_SIZE:], columns=MASTER_COLUMNS),
+                    use_container_width=True, hide_index=True, column_config=MASTER_COLUMN_CONFIG,
+                )
+
+        for msg in refresh.errors: st.error(msg)
+        progress_bar.empty()
+        preview.empty()
+        if refresh.snap is None:
+            # 拉取失败时保留上一份数据，不用空表覆盖
+            status_text.empty()
+            return
+        apply_snapshot(refresh.snap)
+
+        if not refresh.snap["rows"]:
             st.warning("无相同市场")
-            st.session_state.master_df = pd.DataFrame()
-            st.session_state.raw_arb_data = [] 
         else:
-            status_text.text(f"Step 3/4: 同步 {len(common_questions)} 个市场的价格...")
-            
-            prob_token_map = {} 
-            all_tokens_to_fetch = []
-            poly_token_map = {} 
-
-            for q in common_questions:
-                # Probable Logic
-                prob_m = prob_dict[q]
-                p_outcomes = parse_outcomes(prob_m.get("outcomes"))
-                p_tokens = prob_m.get("tokens", [])
-                p_yes = next((t["token_id"] for t in p_tokens if t.get("outcome") == "Yes"), None)
-                p_no = next((t["token_id"] for t in p_tokens if t.get("outcome") == "No"), None)
-                prob_token_map[q] = {"Yes": p_yes, "No": p_no, "Outcomes": p_outcomes}
-                if p_yes: all_tokens_to_fetch.append(p_yes)
-                if p_no: all_tokens_to_fetch.append(p_no)
-
-                # Polymarket Logic
-                poly_m = poly_dict[q]
-                poly_clob_ids = []
-                if "clobTokenIds" in poly_m:
-                    raw_ids = poly_m["clobTokenIds"]
-                    poly_clob_ids = json.loads(raw_ids) if isinstance(raw_ids, str) else raw_ids
-                poly_outcomes = parse_outcomes(poly_m.get("outcomes"))
-                poly_yes_id = None
-                poly_no_id = None
-                if len(poly_clob_ids) == len(poly_outcomes):
-                    for idx, out_name in enumerate(poly_outcomes):
-                        if out_name == "Yes": poly_yes_id = poly_clob_ids[idx]
-                        if out_name == "No": poly_no_id = poly_clob_ids[idx]
-                elif len(poly_clob_ids) >= 2:
-                    poly_yes_id = poly_clob_ids[0]
-                    poly_no_id = poly_clob_ids[1]
-                poly_token_map[q] = {"Yes": poly_yes_id, "No": poly_no_id}
-            
-            price_data = get_probable_prices_batch(all_tokens_to_fetch)
-            progress_bar.progress(75)
-
-            rows_data = [] 
-            raw_arb_data = [] 
-
-            for q in common_questions:
-                poly_m = poly_dict[q]
-                prob_m = prob_dict[q]
-                outcomes_list = parse_outcomes(poly_m.get("outcomes"))
-                name_a = outcomes_list[0]
-                name_b = outcomes_list[1] if len(outcomes_list) > 1 else "No"
-                
-                raw_prices = poly_m.get("outcomePrices", [])
-                if isinstance(raw_prices, str):
-                    try: prices = json.loads(raw_prices)
-                    except: prices = []
-                else: prices = raw_prices
-                
-                try:
-                    poly_p_yes = float(prices[0]) if len(prices) > 0 else 0.0
-                    poly_p_no = float(prices[1]) if len(prices) > 1 else 0.0
-                    poly_price_str = f"{name_a}: {poly_p_yes:.1%} / {name_b}: {poly_p_no:.1%}"
-                except: 
-                    poly_p_yes, poly_p_no = 0.0, 0.0
-                    poly_price_str = "Err"
-                
-                poly_liq = safe_float(poly_m.get("liquidity", 0))
-                poly_vol = safe_float(poly_m.get("volume24hr", 0))
-                if poly_vol == 0: poly_vol = safe_float(poly_m.get("volume", 0))
-
-                prob_info = prob_token_map.get(q, {})
-                id_yes = prob_info.get("Yes")
-                id_no = prob_info.get("No")
-                prob_raw_yes = price_data.get(id_yes, {}).get("BUY", "0") if id_yes else "0"
-                prob_raw_no = price_data.get(id_no, {}).get("BUY", "0") if id_no else "0"
-                
-                try:
-                    prob_p_yes = float(prob_raw_yes)
-                    prob_p_no = float(prob_raw_no)
-                    prob_price_str = f"{name_a}: {prob_p_yes:.1%} / {name_b}: {prob_p_no:.1%}"
-                except: 
-                    prob_p_yes, prob_p_no = 0.0, 0.0
-                    prob_price_str = "N/A"
-                prob_liq = safe_float(prob_m.get("liquidity", 0))
-                prob_vol = safe_float(prob_m.get("volume24hr", 0))
-
-                rows_data.append([
-                    poly_m["question"],
-                    poly_price_str, prob_price_str,
-                    poly_liq, poly_vol,
-                    prob_liq, prob_vol
-                ])
-
-                if (poly_p_yes > 0.005 or poly_p_no > 0.005) and (prob_p_yes > 0.005 or prob_p_no > 0.005): 
-                    raw_arb_data.append({
-                        "question": poly_m["question"],
-                        "outcome_a": name_a,
-                        "outcome_b": name_b,
-                        "poly_yes": poly_p_yes,
-                        "poly_no": poly_p_no,
-                        "prob_yes": prob_p_yes,
-                        "prob_no": prob_p_no,
-                        "prob_yes_id": id_yes,
-                        "prob_no_id": id_no,
-                        "poly_yes_id": poly_token_map[q]["Yes"],
-                        "poly_no_id": poly_token_map[q]["No"]
-                    })
-
-            columns = pd.MultiIndex.from_tuples([
-                ("市场信息", "市场名称"),
-                ("价格详情", "Polymarket"), 
-                ("价格详情", "Probable"),   
-                ("Polymarket 资金", "流动性 ($)"),
-                ("Polymarket 资金", "24h 量 ($)"),
-                ("Probable 资金", "流动性 ($)"),
-                ("Probable 资金", "24h 量 ($)")
-            ])
-            st.session_state.master_df = pd.DataFrame(rows_data, columns=columns)
-            st.session_state.raw_arb_data = raw_arb_data
-            
-            status_text.success(f"数据加载完成！")
-            progress_bar.empty()
+            first = f"，首批结果 {refresh.first_row_at - refresh.started_at:.1f}s" if refresh.first_row_at else ""
+            status_text.success(f"数据加载完成！用时 {time.time() - refresh.started_at:.1f}s{first}")
             st.rerun()
 
     except Exception as e:
         st.error(f"发生错误: {e}")
 
+# ==========================================
+# 📦 读取最新快照 (冷启动或扫描进程发布了新数据)
+# ==========================================
+# scanner.py 在运行时由它负责定时刷新，页面只读取快照
+scanner_alive = get_catalog_store().scanner_alive()
+snapshot_at = get_catalog_store().snapshot_created_at()
+if snapshot_at and snapshot_at > st.session_state.get('snapshot_at', 0):
+    apply_snapshot(get_catalog_store().load_snapshot())
+# 没有扫描进程时由后台线程在快照过期前重取；记录访问时间，无人访问时暂停
+background = get_background_state()
+background["last_seen"] = time.time()
+if not scanner_alive: revalidate(background)
+
+# ==========================================
+# 📊 顶部常驻仪表盘
+# ==========================================
+with st.container(border=True):
+    col_m1, col_m2, col_m3 = st.columns(3)
+    col_m1.metric("🔵 Polymarket 活跃市场", st.session_state['stats_poly_count'])
+    col_m2.metric("🟠 Probable 活跃市场", st.session_state['stats_prob_count'])
+    col_m3.metric("🔗 匹配成功", st.session_state['stats_match_count'], help=f"其中模糊匹配 {st.session_state.get('stats_fuzzy_count', 0)} 个")
+    render_snapshot_age(scanner_alive)
+    with st.expander("🩺 性能诊断", expanded=False):
+        if scanner_alive: st.caption("目录抓取由后台扫描进程负责，其指标见扫描进程的 --metrics-port / ARB_METRICS_FILE")
+        render_diagnostics()
+
+@st.fragment
+def render_market_table(df, selected_market):
+    """对比表只渲染当前页 (或选中的一行)；翻页只重跑本片段"""
+    if selected_market:
+        row = st.session_state.market_index.get(selected_market)
+        page_df = df.iloc[[row]] if row is not None else df.iloc[:0]
+        caption = f"📊 当前显示 {len(page_df)} 条数据"
+    else:
+        pages = max(1, -(-len(df) // TABLE_PAGE_SIZE))
+        page = 1
+        if pages > 1:
+            col_page, _ = st.columns([1, 5])
+            page = col_page.number_input(f"📄 页码 (共 {pages} 页)", min_value=1, max_value=pages, value=1, step=1)
+        start = (page - 1) * TABLE_PAGE_SIZE
+        page_df = df.iloc[start:start + TABLE_PAGE_SIZE]
+        caption = f"📊 共 {len(df)} 条数据 · 第 {page}/{pages} 页 (第 {start + 1}-{start + len(page_df)} 条)"
+    st.dataframe(page_df, use_container_width=True, hide_index=True, column_config=MASTER_COLUMN_CONFIG)
+    st.caption(caption)
+
+@st.fragment
+def render_fuzzy_review():
+    """模糊配对人工确认：确认后下一轮刷新才参与套利扫描 (措辞相近不代表是同一个市场)"""
+    pairs = st.session_state.fuzzy_pairs
+    pending = sum(1 for p in pairs if not p["confirmed"])
+    with st.expander(f"🔀 模糊匹配确认 ({len(pairs)} 个，{pending} 个待确认)", expanded=False):
+        edited = st.data_editor(
+            pd.DataFrame(pairs, columns=["confirmed", "score", "poly_question", "prob_question", "poly_id", "prob_id"]),
+            use_container_width=True, hide_index=True, key="fuzzy_review",
+            disabled=["score", "poly_question", "prob_question", "poly_id", "prob_id"],
+            column_order=["confirmed", "score", "poly_question", "prob_question"],
+            column_config={
+                "confirmed": st.column_config.CheckboxColumn("确认"),
+                "score": st.column_config.NumberColumn("分数", format="%.1f"),
+                "poly_question": st.column_config.TextColumn("🔵 Polymarket", width="large"),
+                "prob_question": st.column_config.TextColumn("🟠 Probable", width="large"),
+            },
+        )
+        store = get_catalog_store()
+        for pair, confirmed in zip(pairs, edited["confirmed"]):
+            if bool(confirmed) != pair["confirmed"]:
+                store.confirm_pair(pair["poly_id"], pair["prob_id"], bool(confirmed))
+                pair["confirmed"] = bool(confirmed)
+        st.caption("确认 / 撤销在下一轮刷新后生效")
+
+@st.fragment
+def render_spread_history(market):
+    """选中市场的价差历史：历史库按桶降采样 (min / max / last)，只取回 HISTORY_BUCKETS 个点"""
+    window = st.radio("📈 价差历史", list(HISTORY_WINDOWS), index=2, horizontal=True, key="history_window")
+    end = time.time()
+    series = get_spread_history().query(market, end - HISTORY_WINDOWS[window], end, HISTORY_BUCKETS)
+    if series is None:
+        st.caption("该市场暂无历史记录 (每轮只记录价格有变化的市场)")
+        return
+    index = [datetime.fromtimestamp(ts) for ts in series["ts"]]
+    st.line_chart(pd.DataFrame({
+        "策略A 成本": series["cost_a_last"], "策略A 桶内最低": series["cost_a_min"],
+        "策略B 成本": series["cost_b_last"], "策略B 桶内最低": series["cost_b_min"],
+    }, index=index), y_label="成本 ($)")
+    # 成本 < 1 即存在机会：按桶内最低成本估算窗口内机会持续的时长
+    bucket_minutes = HISTORY_WINDOWS[window] / HISTORY_BUCKETS / 60
+    durations = [
+        f"策略{s} 约 {int(np.sum(series[f'cost_{s.lower()}_min'] < 1.0)) * bucket_minutes:.0f} 分钟"
+        for s in ("A", "B")
+    ]
+    depth = pd.DataFrame({
+        "策略A 真实容量": series["depth_a_max"], "策略B 真实容量": series["depth_b_max"],
+    }, index=index).dropna(how="all")
+    if not depth.empty: st.bar_chart(depth, y_label="容量 ($)")
+    stats = get_spread_history().stats()
+    st.caption(
+        f"⏱️ 窗口内存在机会: {' · '.join(durations)} · "
+        f"历史库 {stats['records']} 条记录 / {stats['markets']} 个市场 / {stats['bytes'] / 1e6:.1f} MB"
+    )
+
+def render_arbitrage_panel():
+    """套利面板：独立的重跑范围，调整滑块/开关或自动刷新时只重跑本面板"""
+    # 期间有新快照发布 (扫描进程或后台同步)：整页重跑，让对比表与计数一起更新
+    if (get_catalog_store().snapshot_created_at() or 0) > st.session_state.get('snapshot_at', 0):
+        st.rerun()
+
+    c1, c2, c3, c4 = st.columns([1, 1, 1, 1])
+    with c1:
+        min_profit = st.slider("💰 最小利润率 (%)", 0.0, 50.0, 0.0, 0.1)
+    with c2:
+        min_cap_filter = st.slider("💧 最小可投入金额过滤 ($)", 0.0, 100.0, 0.0, 1.0, help="0 表示显示所有结果（哪怕只有 $0.1）")
+    with c3:
+        st.write("")
+        st.write("")
+        auto_depth = st.toggle("⚡ 自动计算多档容量 (Auto-Calc)", value=False, help="沿两边完整卖盘逐档推进，按成本阈值 (含手续费) 求最大可成交份数")
+    with c4:
+        st.write("")
+        st.write("")
+        live_books = st.toggle("📡 实时盘口 (WebSocket)", value=False, help="订阅盘口推送，价格与深度直接读取本地盘口")
+
+    changes = st.session_state.get('arb_changes') or []
+    if changes:
+        with st.expander(f"🔔 机会变更 (相对上一轮 {len(changes)} 条)", expanded=False):
+            feed = pd.DataFrame(changes, columns=["event", "question", "strategy_name", "cost", "profit", "prev_cost"])
+            feed["profit"] = feed["profit"] * 100
+            st.dataframe(
+                feed,
+                use_container_width=True,
+                hide_index=True,
+                column_config={
+                    "event": st.column_config.TextColumn("变更", help="appeared 新出现 / disappeared 消失 / moved 成本移动"),
+                    "question": st.column_config.TextColumn("市场", width="large"),
+                    "strategy_name": st.column_config.TextColumn("套利策略"),
+                    "cost": st.column_config.NumberColumn("成本", format="$%.3f"),
+                    "profit": st.column_config.NumberColumn("收益率", format="+%.1f%%"),
+                    "prev_cost": st.column_config.NumberColumn("原成本", format="$%.3f"),
+                }
+            )
+
+    if 'arb_frame' not in st.session_state or st.session_state.arb_frame.empty: return
+    threshold_cost = 1.0 - (min_profit / 100.0)
+    arb_frame = st.session_state.arb_frame
+    live = None
+    if live_books:
+        live = get_stream_manager()
+        live.track("poly", arb_frame[["poly_yes_id", "poly_no_id"]].to_numpy().ravel().tolist())
+        live.track("prob", arb_frame[["prob_yes_id", "prob_no_id"]].to_numpy().ravel().tolist())
+        arb_frame = apply_live_prices(arb_frame, live)
+        for venue, info in live.status().items():
+            st.caption(f"📡 {venue}: {'已连接' if info['connected'] else '连接中'} · 已同步盘口 {info['synced']}/{info['tokens']} · 消息 {info['messages']} · 重建快照 {info['resyncs']}")
+
+    # 已按收益率降序
+    candidates = scan_arbitrage(arb_frame, threshold_cost)
+    final_df = pd.DataFrame({
+        "市场": candidates["question"],
+        "匹配": candidates["match"],
+        "策略": candidates["strategy_name"],
+        "成本": candidates["cost"],
+        "收益率": candidates["raw_profit"] * 100,
+        "Poly深度": np.nan,
+        "Prob深度": np.nan,
+        "真实容量": np.nan,
+        "份数": np.nan,
+        "预期利润": np.nan,
+    })
+
+    if not auto_depth:
+        st.info(f"ℹ️ 自动计算已关闭。发现 {len(candidates)} 个理论机会。")
+    else:
+        status_box = st.empty()
+        cache_caption = st.empty()
+        depth_progress = st.progress(0)
+
+        def show_depth_progress(done, total):
+            status_box.text(f"正在并发查询盘口 ({done}/{total})...")
+            depth_progress.progress(done / total)
+
+        pairs = list(zip(candidates["poly_side_id"], candidates["prob_side_id"]))
+        # 五元组 (总投入, Poly端投入, Prob端投入, 份数, 预期利润)，与 candidates 一一对应；收益率高的候选优先查询
+        capacities = calculate_arb_capacity_batch(
+            pairs, on_progress=show_depth_progress, live=live,
+            priorities=candidates["raw_profit"].to_numpy(), deadline=time.monotonic() + DEPTH_DEADLINE,
+            threshold_cost=threshold_cost,
+        )
+        # 未取得盘口的候选为 None -> NaN，表格中留空
+        capacities = np.array(capacities, dtype="float64").reshape(-1, 5)
+        final_df["真实容量"] = capacities[:, 0]
+        final_df["Poly深度"] = capacities[:, 1]
+        final_df["Prob深度"] = capacities[:, 2]
+        final_df["份数"] = capacities[:, 3]
+        final_df["预期利润"] = capacities[:, 4]
+        # 没有 scanner.py 在跑时，历史图中的真实容量只能来自这里
+        known = np.flatnonzero(~np.isnan(capacities[:, 0]))
+        record_spread_history(time.time(), {}, [
+            (candidates["question"].iat[i], {f"depth_{candidates['strat'].iat[i].lower()}": capacities[i, 0]})
+            for i in known
+        ])
+        # 显示所有 >= min_cap_filter 的机会，容量未知的保留
+        unknown = np.isnan(capacities[:, 0])
+        final_df = final_df[unknown | (capacities[:, 0] >= min_cap_filter)]
+        depth_progress.empty()
+        status_box.empty()
+        if unknown.any():
+            st.caption(f"⏳ {int(unknown.sum())} 个机会在 {DEPTH_DEADLINE:.0f}s 预算内未取得盘口 (限流或请求失败)，容量列留空")
+
+        cache_stats = get_book_cache().stats()
+        cache_caption.caption(
+            f"💾 盘口缓存: 命中率 {cache_stats['hit_rate']:.0%} "
+            f"(命中 {cache_stats['hits']} / 合并 {cache_stats['coalesced']} / 未命中 {cache_stats['misses']}) · "
+            f"{cache_stats['size']}/{cache_stats['max_entries']} 条 · TTL {cache_stats['ttl']:.0f}s"
+        )
+
+    if not final_df.empty:
+        if auto_depth:
+            st.success(f"✅ 完成！发现 {len(final_df)} 个机会。")
+        else:
+            st.warning(f"⚠️ 发现 {len(final_df)} 个理论机会。")
+
+        st.dataframe(
+            final_df,
+            use_container_width=True,
+            hide_index=True,
+            column_config={
+                "策略": st.column_config.TextColumn("套利策略", width="large"),
+                "匹配": st.column_config.TextColumn("匹配", help="🔀 为人工确认过的模糊匹配"),
+                "成本": st.column_config.NumberColumn("成本", format="$%.3f"),
+                "收益率": st.column_config.NumberColumn("收益率", format="+%.1f%%"),
+                "Poly深度": st.column_config.NumberColumn("Poly端投入", format="dollar", help="Polymarket 一侧逐档买入的金额 (含手续费)，空白为未计算"),
+                "Prob深度": st.column_config.NumberColumn("Prob端投入", format="dollar", help="Probable 一侧逐档买入的金额 (含手续费)，空白为未计算"),
+                "真实容量": st.column_config.NumberColumn("真实容量 (总投入)", format="dollar", help="两边合计投入，只买入每份成本低于阈值的档位；空白为未计算"),
+                "份数": st.column_config.NumberColumn("份数", format="%.0f", help="两边各买入的份数，到期每对兑付 $1"),
+                "预期利润": st.column_config.NumberColumn("预期利润", format="dollar", help="份数 - 总投入"),
+            }
+        )
+    else:
+        if auto_depth:
+            st.warning(f"🤷‍♂️ 未发现有效机会 (所有机会的容量均小于 ${min_cap_filter})。")
+        else:
+            st.info("暂无理论套利机会。")
+
 # --- 主界面 UI ---
 
 col_search, col_reset, col_refresh = st.columns([5, 1, 1], gap="small")
@@ -313,17 +477,18 @@ with col_refresh:
     st.write("") 
     st.write("") 
     if st.button("🔄 刷新数据", type="primary", use_container_width=True):
-        load_and_process_data()
+        if scanner_alive:
+            st.rerun()   # 扫描进程负责抓取，这里只重新读取最新快照
+        else:
+            load_and_process_data()
 
 if 'master_df' in st.session_state and not st.session_state.master_df.empty:
     df = st.session_state.master_df
     
-    market_col_key = ("市场信息", "市场名称")
     with col_search:
-        market_options = df[market_col_key].tolist()
         selected_market = st.selectbox(
             "🔍 搜索/筛选市场", 
-            options=market_options,
+            options=st.session_state.market_options,
             index=None,
             key="market_select",
             placeholder="输入关键词...",
@@ -334,25 +499,9 @@ if 'master_df' in st.session_state and not st.session_state.master_df.empty:
         st.write("")
         st.button("❌ 重置", on_click=clear_selection, use_container_width=True)
 
-    if selected_market:
-        filtered_df = df[df[market_col_key] == selected_market].copy()
-    else:
-        filtered_df = df.copy()
-
-    format_cols = [
-        ("Polymarket 资金", "流动性 ($)"),
-        ("Polymarket 资金", "24h 量 ($)"),
-        ("Probable 资金", "流动性 ($)"),
-        ("Probable 资金", "24h 量 ($)")
-    ]
-    format_dict = {col: "${:,.0f}" for col in format_cols}
-    
-    styled_df = filtered_df.style.format(format_dict).set_properties(
-        subset=format_cols, **{'text-align': 'center'}
-    ).set_table_styles([{'selector': 'th', 'props': [('text-align', 'center'), ('vertical-align', 'middle')]}])
-
-    st.dataframe(styled_df, use_container_width=True, hide_index=True)
-    st.caption(f"📊 当前显示 {len(filtered_df)} 条数据")
+    render_market_table(df, selected_market)
+    if st.session_state.get('fuzzy_pairs'): render_fuzzy_review()
+    if selected_market: render_spread_history(selected_market)
 
     # ==========================================
     # 🚀 套利机会监测 (修复版 - 移除 Matplotlib 依赖)
@@ -360,123 +509,14 @@ if 'master_df' in st.session_state and not st.session_state.master_df.empty:
     st.markdown("---") 
     
     with st.container(border=True):
-        st.subheader("🚀 套利机会扫描 (Arbitrage)")
-        
-        c1, c2, c3 = st.columns([1, 1, 1])
-        with c1:
-            min_profit = st.slider("💰 最小利润率 (%)", 0.0, 50.0, 0.0, 0.1)
-        with c2:
-            min_cap_filter = st.slider("💧 最小卖一容量过滤 ($)", 0.0, 100.0, 0.0, 1.0, help="0 表示显示所有结果（哪怕只有 $0.1）")
-        with c3:
-            st.write("")
-            st.write("")
-            auto_depth = st.toggle("⚡ 自动计算卖一容量 (Auto-Calc)", value=False)
-
-        if 'raw_arb_data' in st.session_state and st.session_state.raw_arb_data:
-            threshold_cost = 1.0 - (min_profit / 100.0)
-            
-            candidates = []
-            
-            for item in st.session_state.raw_arb_data:
-                name_buy = ""
-                name_sell = ""
-                strat_name = ""
-
-                # A: Poly Yes + Prob No
-                cost_a = item['poly_yes'] + item['prob_no']
-                if cost_a < threshold_cost:
-                    name_buy = item['outcome_a']
-                    name_sell = item['outcome_b']
-                    strat_name = f"🔵Poly({name_buy}) + 🟠Prob({name_sell})"
-                    candidates.append({**item, "strat": "A", "cost": cost_a, "raw_profit": (1-cost_a)/cost_a, "strategy_name": strat_name})
-                
-                # B: Poly No + Prob Yes
-                cost_b = item['poly_no'] + item['prob_yes']
-                if cost_b < threshold_cost:
-                    name_buy = item['outcome_b']
-                    name_sell = item['outcome_a']
-                    strat_name = f"🔵Poly({name_buy}) + 🟠Prob({name_sell})"
-                    candidates.append({**item, "strat": "B", "cost": cost_b, "raw_profit": (1-cost_b)/cost_b, "strategy_name": strat_name})
-
-            final_data = []
-
-            if not auto_depth:
-                st.info(f"ℹ️ 自动计算已关闭。发现 {len(candidates)} 个理论机会。")
-                for cand in candidates:
-                    final_data.append({
-                        "市场": cand['question'],
-                        "策略": cand['strategy_name'],
-                        "成本": cand['cost'],
-                        "收益率": cand['raw_profit'],
-                        "Poly深度": None,
-                        "Prob深度": None,
-                        "真实容量": None 
-                    })
-            else:
-                status_box = st.empty()
-                sorted_candidates = sorted(candidates, key=lambda x: x['raw_profit'], reverse=True)
-                total_c = len(sorted_candidates)
-                
-                cache_size = len(st.session_state.get('depth_cache', {}))
-                st.caption(f"💾 已缓存数据: {cache_size} 条")
-
-                for idx, cand in enumerate(sorted_candidates):
-                    status_box.text(f"正在查询卖一 ({idx+1}/{total_c}): {cand['question']}...")
-                    
-                    poly_side_id = cand['poly_yes_id'] if cand['strat'] == 'A' else cand['poly_no_id']
-                    prob_side_id = cand['prob_no_id'] if cand['strat'] == 'A' else cand['prob_yes_id']
-                    
-                    # 返回三元组
-                    (real_cap, cap_poly, cap_prob) = calculate_arb_capacity(poly_side_id, prob_side_id)
-                    
-                    # 显示所有 > min_cap_filter 的机会
-                    if real_cap >= min_cap_filter: 
-                        final_data.append({
-                            "市场": cand['question'],
-                            "策略": cand['strategy_name'],
-                            "成本": cand['cost'],
-                            "收益率": cand['raw_profit'],
-                            "Poly深度": cap_poly,
-                            "Prob深度": cap_prob,
-                            "真实容量": real_cap
-                        })
-                status_box.empty()
-
-            if final_data:
-                final_df = pd.DataFrame(final_data)
-                final_df = final_df.sort_values(by="收益率", ascending=False)
-                
-                if auto_depth:
-                    st.success(f"✅ 完成！发现 {len(final_df)} 个机会。")
-                else:
-                    st.warning(f"⚠️ 发现 {len(final_df)} 个理论机会。")
-
-                # --- 修复点：移除了 .background_gradient(...) ---
-                styled_final = final_df.style.format({
-                    "成本": "${:.3f}",
-                    "收益率": "+{:.1%}",
-                    "Poly深度": "${:,.2f}",
-                    "Prob深度": "${:,.2f}",
-                    "真实容量": "${:,.2f}",
-                }, na_rep="未计算")
-                # ----------------------------------------------
-
-                st.dataframe(
-                    styled_final,
-                    use_container_width=True,
-                    hide_index=True,
-                    column_config={
-                        "策略": st.column_config.TextColumn("套利策略", width="large"),
-                        "Poly深度": st.column_config.NumberColumn("Poly深度 (Ask1)", help="Polymarket 卖一档金额"),
-                        "Prob深度": st.column_config.NumberColumn("Prob深度 (Ask1)", help="Probable 卖一档金额"),
-                        "真实容量": st.column_config.NumberColumn("真实容量 (瓶颈)", help="两边取小值，即实际最大可成交额"),
-                    }
-                )
-            else:
-                if auto_depth:
-                    st.warning(f"🤷‍♂️ 未发现有效机会 (所有机会的容量均小于 ${min_cap_filter})。")
-                else:
-                    st.info("暂无理论套利机会。")
+        col_title, col_every = st.columns([5, 1])
+        col_title.subheader("🚀 套利机会扫描 (Arbitrage)")
+        refresh_every = col_every.selectbox(
+            "⏱️ 自动刷新", AUTO_REFRESH_OPTIONS, key="arb_refresh_every",
+            format_func=lambda s: f"每 {s}s" if s else "关闭",
+            help="按间隔只重跑套利面板 (配合实时盘口或自动计算容量使用)",
+        )
+        st.fragment(render_arbitrage_panel, run_every=refresh_every or None)()
 
 else:
     with col_search:
@@ -0,0 +1,185 @@
+"""
+基准测试用的合成数据集
+
+以 fixtures/ 下录制的接口响应为模板，按指定规模生成两边的市场目录、Probable 价格与盘口；
+所有内容由随机种子决定，相同参数每次生成的数据完全一致。
+Probable 一侧按比例混入与 Polymarket 问题完全相同、规范化后相同、仅措辞不同以及互不相关的市场，
+覆盖匹配引擎的三层路径。
+"""
+import json
+import os
+import random
+from datetime import datetime, timedelta, timezone
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# Probable 市场构成 (其余为不相关市场)
+EXACT_SHARE = 0.4
+NORMALIZED_SHARE = 0.1
+FUZZY_SHARE = 0.1
+
+SUBJECTS = [
+    "Trump", "Biden", "Harris", "Newsom", "DeSantis", "Vance", "Musk", "Bezos", "Altman", "Zuckerberg",
+    "Bitcoin", "Ethereum", "Solana", "Dogecoin", "XRP", "Cardano", "Chainlink", "Avalanche", "Litecoin", "Polkadot",
+    "the Lakers", "the Celtics", "the Warriors", "the Knicks", "the Nuggets", "the Chiefs", "the Eagles", "the Bills",
+    "the Ravens", "the Lions", "Real Madrid", "Barcelona", "Arsenal", "Liverpool", "Manchester City", "Bayern Munich",
+    "PSG", "Inter Milan", "Juventus", "Chelsea", "Apple", "Nvidia", "Microsoft", "Tesla", "Amazon", "Google",
+    "Meta", "OpenAI", "Anthropic", "SpaceX", "Taylor Swift", "Beyonce", "Drake", "Kanye West", "Rihanna",
+    "Zelensky", "Putin", "Xi Jinping", "Modi", "Macron", "Starmer", "Merz", "Milei", "Lula", "Netanyahu",
+    "Erdogan", "Sheinbaum", "Carney", "Albanese", "Ishiba", "Djokovic", "Alcaraz", "Sinner", "Swiatek",
+    "Sabalenka", "Verstappen", "Norris", "Leclerc", "Hamilton", "Piastri",
+]
+EVENTS = [
+    "win the election", "resign", "be indicted", "announce a run", "hit an all-time high", "fall below support",
+    "win the championship", "reach the finals", "sign a new deal", "be acquired", "launch a new product",
+    "release an album", "win the title", "be banned", "meet with Putin", "visit China", "win the Grand Slam",
+    "top the rankings", "go bankrupt", "announce layoffs", "raise prices", "win the award", "be sued",
+    "lead the polls", "declare victory", "win the playoffs", "break the record", "leave office",
+    "issue a statement", "cut rates", "approve the ETF", "list on Coinbase", "flip Ethereum", "win MVP",
+    "sign with a new team", "win the Ballon d'Or", "win the league", "be relegated", "win the cup",
+    "reach 1 billion users",
+]
+DEADLINES = [
+    "by March 31, 2026", "by June 30, 2026", "by September 30, 2026", "by December 31, 2026",
+    "in 2026", "in 2027", "before 2027", "before July 2026", "by the end of Q1 2026", "by the end of Q2 2026",
+    "by the end of Q3 2026", "by the end of Q4 2026", "in January 2026", "in February 2026", "in March 2026",
+    "in April 2026", "in May 2026", "in June 2026", "in July 2026", "in August 2026", "in September 2026",
+    "in October 2026", "in November 2026", "in December 2026", "this year",
+]
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURE_DIR, name), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def question_text(code):
+    subject, rest = divmod(code, len(EVENTS) * len(DEADLINES))
+    event, deadline = divmod(rest, len(DEADLINES))
+    suffix = ""
+    if subject >= len(SUBJECTS):
+        # 超出词表组合数时加序号，保证问题唯一
+        subject, cycle = subject % len(SUBJECTS), subject // len(SUBJECTS)
+        suffix = f" (series {cycle})"
+    return f"Will {SUBJECTS[subject]} {EVENTS[event]} {DEADLINES[deadline]}{suffix}?"
+
+
+def normalized_variant(question):
+    """大小写/标点不同，规范化后与原问题相同"""
+    return question.rstrip("?").replace(",", "") + " ?"
+
+
+def fuzzy_variant(question):
+    """语序不同、省略冠词 (数字不变)，只能靠模糊匹配命中"""
+    words = question.rstrip("?").replace(" the ", " ", 1).split()
+    return " ".join(words[-2:]).capitalize() + ", " + " ".join(words[:-2]).lower() + "?"
+
+
+def token_id(rng):
+    return str(rng.getrandbits(252))
+
+
+class Dataset:
+    """
+    poly / prob 为两边的完整目录 (与线上接口同结构的 dict)；
+    prob_prices / book_prices 为 token -> 卖一价，盘口按 token 按需确定性生成。
+    """
+
+    def __init__(self, n, seed=0):
+        self.n = n
+        self.seed = seed
+        rng = random.Random(seed)
+        gamma_tpl = load_fixture("gamma_markets.json")[0]
+        prob_tpl = load_fixture("probable_markets.json")["markets"][0]
+        self.poly_book_tpl = load_fixture("poly_book.json")
+        self.prob_book_tpl = load_fixture("probable_book.json")
+
+        n_exact, n_norm, n_fuzzy = int(n * EXACT_SHARE), int(n * NORMALIZED_SHARE), int(n * FUZZY_SHARE)
+        n_unrelated = n - n_exact - n_norm - n_fuzzy
+        space = max(len(SUBJECTS), -(-(n + n_unrelated) // (len(EVENTS) * len(DEADLINES)))) * len(EVENTS) * len(DEADLINES)
+        codes = rng.sample(range(space), n + n_unrelated)
+        now = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+        self.poly, self.prob = [], []
+        self.prob_prices, self.book_prices = {}, {}
+        for i in range(n):
+            yes_id, no_id = token_id(rng), token_id(rng)
+            p = round(rng.uniform(0.03, 0.97), 3)
+            m = dict(gamma_tpl)
+            question = question_text(codes[i])
+            m.update({
+                "id": str(500000 + i),
+                "question": question,
+                "slug": question.lower().replace(" ", "-").strip("?"),
+                "outcomes": json.dumps(["Yes", "No"]),
+                "outcomePrices": json.dumps([f"{p:.3f}", f"{1 - p:.3f}"]),
+                "clobTokenIds": json.dumps([yes_id, no_id]),
+                "liquidity": f"{rng.uniform(100, 2e6):.4f}",
+                "volume": f"{rng.uniform(1e3, 5e7):.6f}",
+                "volume24hr": rng.uniform(0, 2e6),
+                "updatedAt": (now - timedelta(seconds=rng.uniform(0, 7 * 86400))).isoformat().replace("+00:00", "Z"),
+            })
+            self.poly.append(m)
+            self.book_prices[yes_id], self.book_prices[no_id] = p, round(1 - p, 3)
+
+        for j in range(n):
+            if j < n_exact + n_norm + n_fuzzy:
+                poly_m = self.poly[j]
+                question = poly_m["question"]
+                if j >= n_exact + n_norm: question = fuzzy_variant(question)
+                elif j >= n_exact: question = normalized_variant(question)
+                # 价格围绕 Polymarket 波动，部分组合成本低于 1 形成套利
+                yes = min(0.99, max(0.01, self.book_prices[json.loads(poly_m["clobTokenIds"])[0]] + rng.gauss(0, 0.03)))
+            else:
+                question = question_text(codes[n + j - (n_exact + n_norm + n_fuzzy)])
+                yes = rng.uniform(0.03, 0.97)
+            no = min(0.99, max(0.01, 1 - yes + rng.uniform(-0.03, 0.05)))
+            yes_id, no_id = token_id(rng), token_id(rng)
+            m = dict(prob_tpl)
+            m.update({
+                "id": str(2000 + j),
+                "question": question,
+                "slug": f"market-{2000 + j}",
+                "tokens": [{"token_id": yes_id, "outcome": "Yes"}, {"token_id": no_id, "outcome": "No"}],
+                "liquidity": f"{rng.uniform(100, 3e5):.2f}",
+                "volume24hr": f"{rng.uniform(0, 2e5):.2f}",
+            })
+            self.prob.append(m)
+            self.prob_prices[yes_id], self.prob_prices[no_id] = round(yes, 2), round(no, 2)
+            self.book_prices[yes_id], self.book_prices[no_id] = round(yes, 2), round(no, 2)
+
+        self.expected = {"exact": n_exact, "normalized": n_norm, "fuzzy": n_fuzzy}
+
+    def _ladder(self, token, depth):
+        best = self.book_prices.get(token)
+        if best is None: return None, None
+        rng = random.Random(f"{self.seed}:{token}")
+        asks, bids = [], []
+        for k in range(depth):
+            asks.append((min(0.999, best + k * 0.01), rng.uniform(5, 5000) * (k + 1)))
+            bids.append((max(0.001, best - (k + 1) * 0.01), rng.uniform(5, 5000) * (k + 1)))
+        return asks, bids
+
+    def poly_book(self, token, depth=6):
+        """Polymarket CLOB 的档位为 {price, size} 字符串，卖盘按价格从高到低排列"""
+        asks, bids = self._ladder(token, depth)
+        if asks is None: return None
+        book = dict(self.poly_book_tpl)
+        book.update({
+            "asset_id": token,
+            "asks": [{"price": f"{p:.3f}", "size": f"{s:.2f}"} for p, s in reversed(asks)],
+            "bids": [{"price": f"{p:.3f}", "size": f"{s:.2f}"} for p, s in reversed(bids)],
+        })
+        return book
+
+    def prob_book(self, token, depth=6):
+        """Probable 的档位为 [price, size]，卖盘按价格从低到高排列"""
+        asks, bids = self._ladder(token, depth)
+        if asks is None: return None
+        book = dict(self.prob_book_tpl)
+        book.update({
+            "token_id": token,
+            "asks": [[f"{p:.2f}", f"{s:.2f}"] for p, s in asks],
+            "bids": [[f"{p:.2f}", f"{s:.2f}"] for p, s in bids],
+        })
+        return book
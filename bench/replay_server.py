@@ -0,0 +1,205 @@
+"""
+本地 HTTP 回放服务
+
+用合成数据集 (bench/dataset.py) 模拟 Gamma /markets、Probable /markets/、/prices
+以及两边的 /book、/books 接口，可配置延迟、抖动、429 与失败比例。
+把 core 的接口地址指向本服务即可离线运行整条刷新链路：
+
+    python -m bench.replay_server --markets 10000 --latency-ms 40 --jitter-ms 20 --rate-429 0.02
+    ARB_GAMMA_API=http://127.0.0.1:8765/gamma ARB_PROB_MARKET_API=http://127.0.0.1:8765/probable-market \\
+    ARB_PROB_API=http://127.0.0.1:8765/probable ARB_POLY_CLOB=http://127.0.0.1:8765/clob streamlit run app.py
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from bench.dataset import Dataset
+
+MAX_BATCH = 500      # 批量接口单次最多接受的 token 数，超出返回 413
+
+
+def encode_rows(markets):
+    return [json.dumps(m, separators=(",", ":")).encode() for m in markets]
+
+
+class ReplayServer:
+    """
+    latency / jitter 单位为秒 (每个请求延迟 latency + U(0, jitter))；
+    rate_429 / fail_rate 为请求被拒 (429 + Retry-After) / 出错 (500) 的概率。
+    """
+
+    def __init__(self, dataset, host="127.0.0.1", port=0, latency=0.0, jitter=0.0,
+                 rate_429=0.0, fail_rate=0.0, retry_after=1, seed=0):
+        self.dataset = dataset
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.fail_rate = fail_rate
+        self.retry_after = retry_after
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = Counter()    # "GET /gamma/markets" -> 次数
+        self.statuses = Counter()
+        self.bytes_sent = 0
+
+        # 目录预先序列化，分页时只做切片拼接
+        self._poly_rows = encode_rows(dataset.poly)
+        order = sorted(range(len(dataset.poly)), key=lambda i: dataset.poly[i]["updatedAt"], reverse=True)
+        self._poly_rows_by_updated = [self._poly_rows[i] for i in order]
+        self._prob_rows = encode_rows(dataset.prob)
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                server.handle(self, "GET")
+
+            def do_POST(self):
+                server.handle(self, "POST")
+
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def endpoints(self):
+        """core 中对应的接口地址配置"""
+        return {
+            "GAMMA_API": f"{self.url}/gamma",
+            "PROB_MARKET_API": f"{self.url}/probable-market",
+            "PROB_API": f"{self.url}/probable",
+            "POLY_CLOB": f"{self.url}/clob",
+        }
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": dict(self.requests),
+                "statuses": {str(k): v for k, v in self.statuses.items()},
+                "bytes_sent": self.bytes_sent,
+            }
+
+    # --- 请求处理 ---
+    def handle(self, req, method):
+        parts = urlsplit(req.path)
+        path, query = parts.path, {k: v[-1] for k, v in parse_qs(parts.query).items()}
+        body = None
+        length = int(req.headers.get("Content-Length") or 0)
+        if length:
+            raw = req.rfile.read(length)
+            try: body = json.loads(raw)
+            except ValueError: body = None
+
+        with self._lock:
+            roll = self._rng.random()
+            delay = self.latency + self._rng.uniform(0, self.jitter)
+            self.requests[f"{method} {path}"] += 1
+        if delay: time.sleep(delay)
+
+        if roll < self.rate_429:
+            status, payload = 429, b'{"error":"rate limited"}'
+        elif roll < self.rate_429 + self.fail_rate:
+            status, payload = 500, b'{"error":"internal error"}'
+        else:
+            status, payload = self.route(method, path, query, body)
+        self.respond(req, status, payload)
+
+    def respond(self, req, status, payload):
+        req.send_response(status)
+        req.send_header("Content-Type", "application/json")
+        req.send_header("Content-Length", str(len(payload)))
+        if status == 429: req.send_header("Retry-After", str(self.retry_after))
+        req.end_headers()
+        req.wfile.write(payload)
+        with self._lock:
+            self.statuses[status] += 1
+            self.bytes_sent += len(payload)
+
+    def route(self, method, path, query, body):
+        ds = self.dataset
+        if method == "GET" and path == "/gamma/markets":
+            offset, limit = int(query.get("offset", 0)), int(query.get("limit", 100))
+            rows = self._poly_rows_by_updated if query.get("order") == "updatedAt" else self._poly_rows
+            return 200, b"[" + b",".join(rows[offset:offset + limit]) + b"]"
+        if method == "GET" and path in ("/probable-market/markets/", "/probable-market/markets"):
+            page, limit = int(query.get("page", 1)), int(query.get("limit", 100))
+            rows = self._prob_rows[(page - 1) * limit:page * limit]
+            return 200, b'{"markets":[' + b",".join(rows) + b'],"pagination":' + json.dumps(
+                {"page": page, "limit": limit, "total": len(self._prob_rows)}).encode() + b"}"
+        if method == "POST" and path == "/probable/prices":
+            if not isinstance(body, list): return 400, b'{"error":"bad request"}'
+            if len(body) > MAX_BATCH: return 413, b'{"error":"too many tokens"}'
+            prices = {}
+            for item in body:
+                t = item.get("token_id") if isinstance(item, dict) else None
+                if t in ds.prob_prices:
+                    p = ds.prob_prices[t]
+                    prices[t] = {"BUY": f"{p:.2f}", "SELL": f"{max(0.01, p - 0.01):.2f}"}
+            return 200, json.dumps(prices).encode()
+        for prefix, make_book in (("/clob", ds.poly_book), ("/probable", ds.prob_book)):
+            if method == "GET" and path == f"{prefix}/book":
+                book = make_book(query.get("token_id"))
+                if book is None: return 404, b'{"error":"No orderbook exists for the requested token id"}'
+                return 200, json.dumps(book).encode()
+            if method == "POST" and path == f"{prefix}/books":
+                if not isinstance(body, list): return 400, b'{"error":"bad request"}'
+                if len(body) > MAX_BATCH: return 413, b'{"error":"too many tokens"}'
+                books = [make_book(item.get("token_id")) for item in body if isinstance(item, dict)]
+                return 200, json.dumps([b for b in books if b is not None]).encode()
+        return 404, b'{"error":"not found"}'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Polymarket / Probable 接口本地回放服务")
+    parser.add_argument("--markets", type=int, default=1000, help="每个平台的合成市场数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="每个请求的基础延迟 (毫秒)")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="额外随机延迟上限 (毫秒)")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="返回 429 的概率")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="返回 500 的概率")
+    args = parser.parse_args(argv)
+
+    server = ReplayServer(
+        Dataset(args.markets, args.seed), args.host, args.port,
+        latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000,
+        rate_429=args.rate_429, fail_rate=args.fail_rate, seed=args.seed,
+    )
+    print(f"回放服务已启动: {server.url}")
+    for name, url in server.endpoints().items():
+        print(f"  ARB_{name}={url}")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._httpd.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
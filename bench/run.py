@@ -0,0 +1,158 @@
+"""
+离线基准测试
+
+对每个规模启动一个回放服务 (bench/replay_server.py)，把 core 的接口地址指向它，
+按 load_and_process_data 的阶段计时：目录同步 (catalog)、匹配 (matching)、价格同步 (price_sync)、
+对比表生成 (table_build)，再计时套利扫描 (scan) 与 Auto-Calc 深度扫描 (depth_scan，冷/热缓存各一次)；
+最后从冷启动跑一次流水线刷新 (core.PipelinedRefresh)，记录首批行出现的时间与总耗时。
+结果以 JSON 输出，便于跟踪回归：
+
+    python -m bench.run --scales 1000,10000,50000 --latency-ms 30 --jitter-ms 20 --output bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import core
+from bench.dataset import Dataset
+from bench.replay_server import ReplayServer
+from catalog_store import CatalogStore
+
+STAGES = ("catalog", "matching", "price_sync", "table_build", "scan", "depth_scan", "depth_scan_warm")
+PIPELINE_STAGES = ("pipelined_first_row", "pipelined_total")
+
+
+def reset_caches():
+    """每轮都从冷启动开始：匹配打分缓存、增量重算状态、盘口缓存、分块大小与批量接口探测结果全部清空"""
+    for fn in (core.get_matcher, core.get_delta_engine, core.get_book_cache, core.get_chunkers, core.get_http_session, core.get_scheduler):
+        fn.cache_clear()
+    core.BulkJob.unsupported.clear()
+
+
+def run_once(server, depth_limit, deadline=None, host_rate=None):
+    for name, url in server.endpoints().items():
+        setattr(core, name, url)
+    reset_caches()
+    if host_rate: core.get_scheduler().default_rate = host_rate
+
+    timings, counts = {}, {}
+    with tempfile.TemporaryDirectory() as tmp:
+        store = CatalogStore(os.path.join(tmp, "catalog.db"))
+        t0 = time.perf_counter()
+        poly, prob, errors = core.sync_catalogs(store)
+        timings["catalog"] = time.perf_counter() - t0
+        store.close()
+
+    snap = core.process_markets(poly, prob, timings=timings)
+
+    t0 = time.perf_counter()
+    candidates = core.scan_arbitrage(core.build_arb_frame(snap["arb"]), 1.0)
+    timings["scan"] = time.perf_counter() - t0
+
+    top = candidates.head(depth_limit) if depth_limit else candidates
+    pairs = list(zip(top["poly_side_id"], top["prob_side_id"]))
+    t0 = time.perf_counter()
+    capacities = core.calculate_arb_capacity_batch(
+        pairs, priorities=top["raw_profit"].to_numpy(),
+        deadline=time.monotonic() + deadline if deadline else None)
+    timings["depth_scan"] = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    core.calculate_arb_capacity_batch(pairs)
+    timings["depth_scan_warm"] = time.perf_counter() - t0
+
+    # 流水线刷新：目录分页、匹配、取价重叠进行，对比上面逐阶段串行的 catalog ~ table_build
+    reset_caches()
+    if host_rate: core.get_scheduler().default_rate = host_rate
+    with tempfile.TemporaryDirectory() as tmp:
+        store = CatalogStore(os.path.join(tmp, "catalog.db"))
+        refresh = core.PipelinedRefresh(store).start()
+        refresh.done.wait()
+        store.close()
+    timings["pipelined_first_row"] = (refresh.first_row_at or time.time()) - refresh.started_at
+    timings["pipelined_total"] = time.time() - refresh.started_at
+
+    counts.update({
+        "poly_markets": len(poly),
+        "prob_markets": len(prob),
+        "matched": snap["stats"]["match"],
+        "fuzzy": snap["stats"]["fuzzy"],
+        "arb_rows": len(snap["arb"]),
+        "candidates": len(candidates),
+        "depth_pairs": len(pairs),
+        "depth_missing": sum(1 for capacity in capacities if capacity[0] is None),
+        "errors": len(errors),
+    })
+    return timings, counts
+
+
+def run_scale(n, args):
+    dataset = Dataset(n, args.seed)
+    server = ReplayServer(
+        dataset, latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000,
+        rate_429=args.rate_429, fail_rate=args.fail_rate, seed=args.seed,
+    ).start()
+    runs = []
+    try:
+        for i in range(args.repeat):
+            timings, counts = run_once(server, args.depth, args.depth_deadline, args.host_rate)
+            runs.append({"timings": timings, "counts": counts})
+            total = sum(timings[s] for s in STAGES if s != "depth_scan_warm")
+            print(f"[{n}] 第 {i + 1}/{args.repeat} 轮: {total:.2f}s "
+                  + " ".join(f"{s}={timings[s]:.3f}" for s in STAGES + PIPELINE_STAGES), file=sys.stderr)
+    finally:
+        server.stop()
+    return {
+        "markets": n,
+        "expected_matches": dataset.expected,
+        "stages": {s: statistics.median(r["timings"][s] for r in runs) for s in STAGES + PIPELINE_STAGES},
+        "counts": runs[-1]["counts"],
+        "server": server.stats(),
+        "runs": runs,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="离线刷新链路基准测试")
+    parser.add_argument("--scales", default="1000,10000,50000", help="每个平台的市场数，逗号分隔")
+    parser.add_argument("--repeat", type=int, default=1, help="每个规模重复次数 (取中位数)")
+    parser.add_argument("--depth", type=int, default=0, help="深度扫描的候选数上限 (0 表示全部)")
+    parser.add_argument("--depth-deadline", type=float, default=0.0, help="深度扫描时间预算 (秒，0 表示不限)")
+    parser.add_argument("--host-rate", type=float, default=0.0, help="回放服务的每秒请求上限 (0 表示沿用 ARB_HOST_RATE)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--jitter-ms", type=float, default=10.0)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--output", default=None, help="结果写入文件 (默认输出到 stdout)")
+    args = parser.parse_args(argv)
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "latency_ms": args.latency_ms, "jitter_ms": args.jitter_ms,
+            "rate_429": args.rate_429, "fail_rate": args.fail_rate,
+            "repeat": args.repeat, "depth": args.depth, "depth_deadline": args.depth_deadline,
+            "host_rate": args.host_rate or core.get_scheduler().default_rate, "seed": args.seed,
+            "concurrent_fetch": core.CONCURRENT_FETCH,
+        },
+        "results": [run_scale(int(n), args) for n in args.scales.split(",") if n.strip()],
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
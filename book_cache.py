@@ -0,0 +1,112 @@
+"""
+进程内共享的盘口快照缓存
+
+按 token 缓存 (而非按候选对)，带 TTL 与 LRU 容量上限；
+多个会话同时查询同一 token 时只有一个调用方实际请求，其余等待其结果，避免击穿。
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data = OrderedDict()     # key -> (stored_at, value)，按最近使用排序
+        self._inflight = {}            # key -> Event，正在加载的 key
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0             # 等待其他调用方加载结果的次数
+        self.evictions = 0
+        self.expirations = 0
+
+    def _get_fresh(self, key, now):
+        item = self._data.get(key)
+        if item is None: return None
+        if now - item[0] > self.ttl:
+            del self._data[key]
+            self.expirations += 1
+            return None
+        self._data.move_to_end(key)
+        return item
+
+    def _put(self, key, value, stored_at):
+        self._data[key] = (stored_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def get_many(self, keys, loader, wait_timeout=15.0):
+        """
+        返回 {key: value}。未命中的 key 交给 loader(keys) -> {key: value} 一次性加载；
+        加载失败 (未出现在 loader 结果中) 的 key 不缓存，也不出现在返回值里。
+        """
+        result, to_load, waiting = {}, [], {}
+        now = time.time()
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                item = self._get_fresh(key, now)
+                if item is not None:
+                    result[key] = item[1]
+                    self.hits += 1
+                elif key in self._inflight:
+                    waiting[key] = self._inflight[key]
+                    self.coalesced += 1
+                else:
+                    self._inflight[key] = threading.Event()
+                    to_load.append(key)
+                    self.misses += 1
+
+        loaded = {}
+        try:
+            if to_load: loaded = loader(to_load)
+        finally:
+            with self._lock:
+                stored_at = time.time()
+                for key in to_load:
+                    if key in loaded: self._put(key, loaded[key], stored_at)
+                    self._inflight.pop(key).set()
+        result.update((key, loaded[key]) for key in to_load if key in loaded)
+
+        for key, event in waiting.items():
+            event.wait(wait_timeout)
+            with self._lock:
+                item = self._data.get(key)
+            if item is not None: result[key] = item[1]
+        return result
+
+    def prime(self, items, stored_at):
+        """写入外部 (如后台扫描进程) 在 stored_at 时刻取得的数据；不覆盖更新的条目"""
+        if time.time() - stored_at > self.ttl: return
+        with self._lock:
+            for key, value in items.items():
+                item = self._data.get(key)
+                if item is None or item[0] < stored_at:
+                    self._put(key, value, stored_at)
+
+    def export(self, keys):
+        """导出仍在有效期内的条目 (不计入命中统计)"""
+        now = time.time()
+        with self._lock:
+            return {
+                key: item[1] for key in keys
+                if (item := self._data.get(key)) is not None and now - item[0] <= self.ttl
+            }
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "size": len(self._data),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,539 @@
+"""
+WebSocket 实时盘口
+
+订阅 Polymarket CLOB market 频道 (以及 Probable 的同类频道，如已配置)，
+在内存中为每个 token 维护 L2 盘口 (快照 + 增量)，套利扫描直接读取最优价与深度。
+检测到序号断档时将该 token 标记为未同步，在后台线程重新拉取快照 (不阻塞读取推送)；
+时间戳不晚于当前快照的增量已包含在快照中，直接丢弃。格式错误的单条事件记录后跳过，不影响连接。
+连接断开时全部盘口标记为未同步，连接 (任何推送或 PONG) 与盘口本身都超过 LIVE_BOOK_MAX_AGE
+没有更新时，盘口同样对读者不可见。
+
+离线调试：
+    python book_stream.py record recording.jsonl <token_id> ...   # 录制真实推送
+    python book_stream.py replay recording.jsonl --port 8765      # 本地回放服务
+    python book_stream.py selftest                                # 对本地回放服务验证快照 / 增量 / 断档 / 重建
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from websockets.exceptions import ConnectionClosed
+from websockets.sync.client import connect
+from websockets.sync.server import serve
+
+POLY_WS_URL = "wss://ws-subscriptions-clob.polymarket.com/ws/market"
+# Probable 暂无公开的行情推送地址；配置后按与 Polymarket 相同的消息格式解析
+PROB_WS_URL = os.environ.get("PROB_WS_URL") or None
+PING_INTERVAL = 10       # Polymarket 要求客户端定期发送 PING 保活
+RECONNECT_MAX_DELAY = 30
+# 实时盘口的最长有效期 (秒)：连接在 PING_INTERVAL 内应收到 PONG，超过该时间说明连接已不可信
+LIVE_BOOK_MAX_AGE = float(os.environ.get("ARB_LIVE_BOOK_MAX_AGE", "30"))
+
+
+def parse_level(level):
+    """档位格式：Polymarket 为 {price, size}，Probable 为 [price, size]"""
+    if isinstance(level, dict):
+        return float(level["price"]), float(level["size"])
+    return float(level[0]), float(level[1])
+
+
+class OrderBook:
+    """单个 token 的 L2 盘口：price -> size"""
+
+    def __init__(self):
+        self.bids = {}
+        self.asks = {}
+        self.seq = None
+        self.timestamp = 0
+        self.snapshot_ts = 0     # 最近一次快照的时间戳
+        self.synced = False
+        self.updated_at = 0.0
+
+    def apply_snapshot(self, bids, asks, seq=None, timestamp=0):
+        self.bids = {p: s for p, s in map(parse_level, bids) if s > 0}
+        self.asks = {p: s for p, s in map(parse_level, asks) if s > 0}
+        self.seq = seq
+        self.timestamp = timestamp
+        self.snapshot_ts = timestamp
+        self.synced = True
+        self.updated_at = time.time()
+
+    def apply_change(self, side, price, size):
+        levels = self.bids if side.upper() in ("BUY", "BID", "BIDS") else self.asks
+        if size <= 0:
+            levels.pop(price, None)
+        else:
+            levels[price] = size
+
+    def best_ask(self):
+        if not self.asks: return None
+        price = min(self.asks)
+        return price, self.asks[price]
+
+    def best_bid(self):
+        if not self.bids: return None
+        price = max(self.bids)
+        return price, self.bids[price]
+
+
+class BookStore:
+    """线程安全的 token -> OrderBook 集合；未同步或已过期的盘口对读者不可见"""
+
+    def __init__(self, max_age=LIVE_BOOK_MAX_AGE):
+        self._books = {}
+        self._lock = threading.Lock()
+        self.max_age = max_age
+        self.alive_at = 0.0      # 连接最近一次收到数据 (含 PONG) 的时间
+
+    def touch(self):
+        self.alive_at = time.time()
+
+    def apply_snapshot(self, token_id, bids, asks, seq=None, timestamp=0):
+        with self._lock:
+            self._books.setdefault(token_id, OrderBook()).apply_snapshot(bids, asks, seq, timestamp)
+
+    def apply_changes(self, token_id, changes, seq=None, timestamp=0):
+        """
+        changes 为 [(side, price, size), ...]，size 为该价位的新总量 (0 表示删除)。
+        发现断档 (无快照或序号跳跃) 时返回 False，盘口标记为未同步。
+        快照之前的增量 (时间戳不晚于快照、或早于已应用的增量，序号不大于当前序号) 已包含在盘口中，
+        直接丢弃并返回 True：重建用的快照通常比推送通道里排队的增量新，不能把它们当作断档。
+        """
+        with self._lock:
+            book = self._books.get(token_id)
+            if book is None or not book.synced:
+                return False
+            if timestamp and (timestamp <= book.snapshot_ts or timestamp < book.timestamp):
+                return True
+            if seq is not None and book.seq is not None:
+                if seq <= book.seq: return True
+                if seq != book.seq + 1:
+                    book.synced = False
+                    return False
+            for side, price, size in changes:
+                book.apply_change(side, price, size)
+            if seq is not None: book.seq = seq
+            if timestamp: book.timestamp = timestamp
+            book.updated_at = time.time()
+            return True
+
+    def mark_stale(self, token_ids=None):
+        with self._lock:
+            for token_id, book in self._books.items():
+                if token_ids is None or token_id in token_ids:
+                    book.synced = False
+
+    def _synced(self, token_id):
+        book = self._books.get(token_id)
+        if book is None or not book.synced: return None
+        # 盘口没有变化时只靠连接保活证明其仍然有效
+        if time.time() - max(book.updated_at, self.alive_at) > self.max_age: return None
+        return book
+
+    def best_ask(self, token_id):
+        with self._lock:
+            book = self._synced(token_id)
+            return book.best_ask() if book else None
+
+    def best_bid(self, token_id):
+        with self._lock:
+            book = self._synced(token_id)
+            return book.best_bid() if book else None
+
+    def ask_ladder(self, token_id):
+        """按价格升序的卖盘 [(price, size), ...]；未同步返回 None"""
+        with self._lock:
+            book = self._synced(token_id)
+            return sorted(book.asks.items()) if book else None
+
+    def synced_count(self):
+        with self._lock:
+            return sum(1 for token_id in self._books if self._synced(token_id))
+
+
+def _event_seq(event):
+    seq = event.get("seq", event.get("sequence"))
+    return int(seq) if seq is not None else None
+
+
+def _event_ts(event):
+    try:
+        return int(event.get("timestamp") or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+class MarketStream(threading.Thread):
+    """
+    一个 WebSocket 连接：订阅 token、把推送应用到 BookStore、断线自动重连。
+    snapshot_fn(token_ids) -> {token_id: book_json} 用于断档后通过 REST 重建快照；
+    未提供时改为重新订阅，由服务端重新推送 book 快照。REST 重建在单独的线程中进行，
+    期间读取推送与 PING 保活照常进行；同一 token 的重建在完成前不会重复发起。
+    """
+
+    def __init__(self, url, store, token_ids=(), snapshot_fn=None, name="stream"):
+        super().__init__(name=f"book-stream-{name}", daemon=True)
+        self.url = url
+        self.store = store
+        self.snapshot_fn = snapshot_fn
+        self.tokens = {t for t in token_ids if t}
+        self._pending = set()      # 待 (重新) 订阅的 token
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self.connected = False
+        self.messages = 0
+        self.resyncs = 0
+        self.bad_events = 0
+        self.last_message_at = 0.0
+        self.last_error = None
+        self._resyncing = set()    # REST 重建进行中的 token
+        self._resync_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"book-resync-{name}")
+
+    def set_tokens(self, token_ids):
+        new = {t for t in token_ids if t} - self.tokens
+        if new:
+            with self._lock:
+                self.tokens |= new
+                self._pending |= new
+
+    def stop(self):
+        self._stop_event.set()
+        self._resync_pool.shutdown(wait=False, cancel_futures=True)
+
+    def run(self):
+        delay = 1
+        while not self._stop_event.is_set():
+            try:
+                with connect(self.url, open_timeout=10, max_size=None) as ws:
+                    self.connected = True
+                    delay = 1
+                    # 重连后所有盘口需等待新快照
+                    self.store.mark_stale(self.tokens)
+                    with self._lock:
+                        self._pending.clear()
+                        tokens = list(self.tokens)
+                    ws.send(json.dumps({"assets_ids": tokens, "type": "market"}))
+                    self._loop(ws)
+            except Exception as e:
+                self.last_error = e
+            finally:
+                self.connected = False
+                # 断线期间收不到增量：盘口不能再当作实时数据读取，等重连后的新快照
+                with self._lock:
+                    tokens = set(self.tokens)
+                self.store.mark_stale(tokens)
+            self._stop_event.wait(delay)
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+    def _loop(self, ws):
+        last_ping = time.monotonic()
+        while not self._stop_event.is_set():
+            with self._lock:
+                pending, self._pending = list(self._pending), set()
+            if pending:
+                ws.send(json.dumps({"assets_ids": pending, "operation": "unsubscribe"}))
+                ws.send(json.dumps({"assets_ids": pending, "operation": "subscribe"}))
+            if time.monotonic() - last_ping >= PING_INTERVAL:
+                ws.send("PING")
+                last_ping = time.monotonic()
+            try:
+                raw = ws.recv(timeout=1)
+            except TimeoutError:
+                continue
+            except ConnectionClosed:
+                return
+            self.handle_message(raw)
+
+    def handle_message(self, raw):
+        self.store.touch()
+        if raw in ("PING", "PONG"): return
+        try:
+            data = json.loads(raw)
+        except ValueError:
+            return
+        self.messages += 1
+        self.last_message_at = time.time()
+        gaps = set()
+        for event in data if isinstance(data, list) else [data]:
+            if not isinstance(event, dict): continue
+            try:
+                gaps |= self._apply_event(event)
+            except (KeyError, TypeError, ValueError, AttributeError) as e:
+                # 单条事件格式错误 (缺 asset_id、size 为 null 等)：跳过该事件，连接与其他盘口不受影响
+                self.bad_events += 1
+                self.last_error = e
+        if gaps:
+            self.resync(gaps)
+
+    def _apply_event(self, event):
+        etype = event.get("event_type") or event.get("type")
+        seq = _event_seq(event)
+        ts = _event_ts(event)
+        if etype == "book":
+            self.store.apply_snapshot(
+                event["asset_id"], event.get("bids", event.get("buys", [])),
+                event.get("asks", event.get("sells", [])), seq, ts,
+            )
+            return set()
+        if etype != "price_change":
+            return set()
+
+        # 旧格式: {asset_id, changes: [...]}；新格式: {price_changes: [{asset_id, ...}]}
+        by_asset = {}
+        if "price_changes" in event:
+            for change in event["price_changes"]:
+                by_asset.setdefault(change["asset_id"], []).append(change)
+        else:
+            by_asset[event["asset_id"]] = event.get("changes", [])
+        gaps = set()
+        for asset_id, changes in by_asset.items():
+            parsed = [(c["side"], float(c["price"]), float(c["size"])) for c in changes]
+            if not self.store.apply_changes(asset_id, parsed, seq, ts):
+                gaps.add(asset_id)
+        return gaps
+
+    def resync(self, token_ids):
+        """在推送线程中调用：只登记断档的 token，REST 重建交给后台线程"""
+        with self._lock:
+            token_ids = set(token_ids) - self._resyncing
+            if not token_ids: return
+            self.resyncs += len(token_ids)
+            if not self.snapshot_fn:
+                self._pending |= token_ids
+                return
+            self._resyncing |= token_ids
+        try:
+            self._resync_pool.submit(self._resync_rest, token_ids)
+        except RuntimeError:     # 已停止
+            with self._lock:
+                self._resyncing -= token_ids
+
+    def _resync_rest(self, token_ids):
+        try:
+            try:
+                books = self.snapshot_fn(list(token_ids))
+            except Exception as e:
+                self.last_error = e
+                books = {}
+            for token_id, book in books.items():
+                try:
+                    self.store.apply_snapshot(
+                        token_id, book.get("bids", []), book.get("asks", []),
+                        _event_seq(book), _event_ts(book),
+                    )
+                except (KeyError, TypeError, ValueError, AttributeError) as e:
+                    self.last_error = e
+            # 没取到快照的改为重新订阅，由服务端推送快照
+            missing = token_ids - set(books)
+            with self._lock:
+                self._pending |= missing
+        finally:
+            with self._lock:
+                self._resyncing -= token_ids
+
+
+class StreamManager:
+    """每个平台一个 BookStore + MarketStream；未配置推送地址的平台不启动"""
+
+    def __init__(self, urls=None, snapshot_fns=None):
+        self.urls = urls or {"poly": POLY_WS_URL, "prob": PROB_WS_URL}
+        self.snapshot_fns = snapshot_fns or {}
+        self.stores = {venue: BookStore() for venue in self.urls}
+        self.streams = {}
+        self._lock = threading.Lock()
+
+    def track(self, venue, token_ids):
+        url = self.urls.get(venue)
+        if not url: return
+        with self._lock:
+            stream = self.streams.get(venue)
+            if stream is None or not stream.is_alive():
+                stream = MarketStream(url, self.stores[venue], token_ids,
+                                      self.snapshot_fns.get(venue), name=venue)
+                self.streams[venue] = stream
+                stream.start()
+            else:
+                stream.set_tokens(token_ids)
+
+    def store(self, venue):
+        """平台未启用推送时返回 None，调用方回退到 REST"""
+        return self.stores[venue] if venue in self.streams else None
+
+    def status(self):
+        return {
+            venue: {
+                "connected": s.connected,
+                "tokens": len(s.tokens),
+                "synced": self.stores[venue].synced_count(),
+                "messages": s.messages,
+                "resyncs": s.resyncs,
+                "bad_events": s.bad_events,
+                "last_error": repr(s.last_error) if s.last_error else None,
+            }
+            for venue, s in self.streams.items()
+        }
+
+    def stop(self):
+        for s in self.streams.values():
+            s.stop()
+
+
+class ReplayServer:
+    """
+    本地回放 WebSocket 服务：客户端订阅后按顺序推送录制的消息 (只推送订阅 token 的事件)。
+    收到 subscribe 操作时重发对应 token 最近一次的 book 快照，用于验证断档后的重建流程。
+    """
+
+    def __init__(self, messages, host="127.0.0.1", port=0, interval=0.0):
+        self.messages = messages
+        self.interval = interval
+        self._server = serve(self._handler, host, port)
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.socket.getsockname()[:2]
+        return f"ws://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        self._server.shutdown()
+
+    @staticmethod
+    def _assets(event):
+        if "price_changes" in event:
+            return {c.get("asset_id") for c in event["price_changes"]}
+        return {event.get("asset_id")}
+
+    def _handler(self, ws):
+        try:
+            assets = set(json.loads(ws.recv()).get("assets_ids", []))
+            snapshots = {}
+            for msg in self.messages:
+                events = msg if isinstance(msg, list) else [msg]
+                events = [e for e in events if self._assets(e) & assets]
+                if not events: continue
+                for e in events:
+                    if (e.get("event_type") or e.get("type")) == "book":
+                        snapshots[e["asset_id"]] = e
+                ws.send(json.dumps(events if isinstance(msg, list) else events[0]))
+                if self.interval: time.sleep(self.interval)
+            for raw in ws:
+                if raw == "PING":
+                    ws.send("PONG")
+                    continue
+                req = json.loads(raw)
+                if req.get("operation") == "subscribe":
+                    assets |= set(req.get("assets_ids", []))
+                    resend = [snapshots[a] for a in req.get("assets_ids", []) if a in snapshots]
+                    if resend: ws.send(json.dumps(resend))
+        except ConnectionClosed:
+            pass
+
+
+def load_recording(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def selftest(timeout=5.0):
+    """
+    对本地回放服务跑一遍典型序列，返回失败项列表 (空表示通过)：
+    token A: 快照 -> 增量 -> 过期增量 (应丢弃) -> 格式错误事件 (应跳过，不占用序号) -> 增量
+    token B: 快照 -> 序号跳跃 (应通过 snapshot_fn 在后台重建)
+    """
+    def change(asset, seq, ts, price, size):
+        return {"event_type": "price_change", "asset_id": asset, "seq": seq, "timestamp": ts,
+                "changes": [{"side": "SELL", "price": price, "size": size}]}
+
+    messages = [
+        {"event_type": "book", "asset_id": "A", "seq": 1, "timestamp": 1000,
+         "bids": [["0.48", "50"]], "asks": [["0.52", "200"], ["0.50", "100"]]},
+        {"event_type": "book", "asset_id": "B", "seq": 1, "timestamp": 1000,
+         "bids": [], "asks": [["0.60", "10"]]},
+        change("B", 5, 1005, "0.61", "20"),
+        change("A", 2, 1001, "0.50", "80"),
+        change("A", 1, 999, "0.50", "5"),
+        {"event_type": "price_change", "asset_id": "A", "seq": 3, "timestamp": 1002,
+         "changes": [{"side": "SELL", "price": "0.49", "size": None}]},
+        change("A", 3, 1003, "0.51", "10"),
+    ]
+    rest_books = {"B": {"seq": 10, "timestamp": 1020, "bids": [], "asks": [["0.45", "30"]]}}
+    expected = {"A": [(0.50, 80.0), (0.51, 10.0), (0.52, 200.0)], "B": [(0.45, 30.0)]}
+
+    def snapshot_fn(token_ids):
+        time.sleep(0.2)      # 模拟 REST 延迟：期间 A 的推送应照常应用
+        return {t: rest_books[t] for t in token_ids if t in rest_books}
+
+    server = ReplayServer(messages)
+    store = BookStore()
+    stream = MarketStream(server.start(), store, ["A", "B"], snapshot_fn, name="selftest")
+    stream.start()
+    deadline = time.monotonic() + timeout
+    try:
+        while time.monotonic() < deadline:
+            if all(store.ask_ladder(t) == ladder for t, ladder in expected.items()): break
+            time.sleep(0.05)
+        failures = [f"{t}: {store.ask_ladder(t)} != {ladder}"
+                    for t, ladder in expected.items() if store.ask_ladder(t) != ladder]
+        if stream.resyncs != 1: failures.append(f"resyncs: {stream.resyncs} != 1")
+        if stream.bad_events != 1: failures.append(f"bad_events: {stream.bad_events} != 1")
+        if not stream.connected: failures.append(f"disconnected: {stream.last_error!r}")
+    finally:
+        stream.stop()
+        server.stop()
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="实时盘口录制 / 本地回放")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    rec = sub.add_parser("record", help="订阅真实推送并按行写入 JSON")
+    rec.add_argument("output")
+    rec.add_argument("token_ids", nargs="+")
+    rec.add_argument("--url", default=POLY_WS_URL)
+    rec.add_argument("--seconds", type=float, default=60)
+    rep = sub.add_parser("replay", help="启动本地回放服务")
+    rep.add_argument("recording")
+    rep.add_argument("--host", default="127.0.0.1")
+    rep.add_argument("--port", type=int, default=8765)
+    rep.add_argument("--interval", type=float, default=0.0, help="消息间隔 (秒)")
+    sub.add_parser("selftest", help="对本地回放服务验证快照 / 增量 / 断档 / 重建")
+    args = parser.parse_args(argv)
+
+    if args.cmd == "selftest":
+        failures = selftest()
+        for line in failures:
+            print(f"FAIL {line}", file=sys.stderr)
+        print("selftest " + ("failed" if failures else "ok"), file=sys.stderr)
+        return 1 if failures else 0
+
+    if args.cmd == "record":
+        deadline = time.monotonic() + args.seconds
+        with connect(args.url, max_size=None) as ws, open(args.output, "w", encoding="utf-8") as out:
+            ws.send(json.dumps({"assets_ids": args.token_ids, "type": "market"}))
+            while time.monotonic() < deadline:
+                try:
+                    raw = ws.recv(timeout=1)
+                except TimeoutError:
+                    continue
+                if raw not in ("PING", "PONG"):
+                    out.write(raw.strip() + "\n")
+        return 0
+
+    server = ReplayServer(load_recording(args.recording), args.host, args.port, args.interval)
+    print(f"replaying {args.recording} on {server.url}", file=sys.stderr)
+    server._server.serve_forever()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
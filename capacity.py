@@ -0,0 +1,79 @@
+"""
+多档、含手续费的套利容量求解
+
+两条腿 (Polymarket 一侧 + Probable 对侧) 买入相同份数，每对份额到期兑付 $1。
+两边卖盘按价格升序同时推进 (merge-walk)：在两边累计数量的每个断点之间，
+边际成本 = 两侧当前档价格 + 各自手续费；边际成本单调不减，低于成本阈值的前缀即可成交部分。
+一批候选补齐为 (候选数, 档位数) 矩阵后一次性向量化求解，不逐个候选循环推进。
+
+手续费按每份 rate × min(p, 1 - p) 计 (Polymarket CLOB 的 taker 费率公式)，两边费率分别由
+ARB_POLY_FEE / ARB_PROB_FEE 配置 (小数，默认 0)。
+"""
+import os
+
+import numpy as np
+
+MAX_LEVELS = 50          # 每条腿最多使用最便宜的多少档
+FEE_RATES = {
+    "poly": float(os.environ.get("ARB_POLY_FEE", "0")),
+    "prob": float(os.environ.get("ARB_PROB_FEE", "0")),
+}
+
+
+def ladder_matrix(ladders, max_levels=MAX_LEVELS):
+    """[[(price, size), ...], ...] -> (prices, sizes) 两个 (K, L) 矩阵，每行按价格升序；空位价格为 inf、数量为 0"""
+    width = max(1, min(max_levels, max((len(levels) for levels in ladders), default=1)))
+    prices = np.full((len(ladders), width), np.inf)
+    sizes = np.zeros((len(ladders), width))
+    for i, levels in enumerate(ladders):
+        if not levels: continue
+        arr = np.asarray(levels, dtype="float64").reshape(-1, 2)
+        # 接口给出的档位顺序不一定是升序 (Polymarket 的 asks 为降序)，这里统一排序
+        arr = arr[(arr[:, 0] > 0.005) & (arr[:, 1] > 0)]
+        arr = arr[np.argsort(arr[:, 0], kind="stable")][:width]
+        prices[i, :len(arr)] = arr[:, 0]
+        sizes[i, :len(arr)] = arr[:, 1]
+    return prices, sizes
+
+
+def unit_cost(prices, fee_rate):
+    """每份成本 = 价格 + 手续费；空位保持 inf"""
+    if not fee_rate: return prices
+    finite = np.isfinite(prices)
+    fee = np.where(finite, fee_rate * np.minimum(prices, 1 - np.where(finite, prices, 0)), 0.0)
+    return prices + fee
+
+
+def solve_capacity(ladders_a, ladders_b, threshold_cost=1.0, fee_a=0.0, fee_b=0.0):
+    """
+    ladders_a / ladders_b 为与候选一一对应的两条腿卖盘 [(price, size), ...]。
+    返回 (K, 5) 数组，每行为 (总投入, A 腿投入, B 腿投入, 份数, 预期利润)，金额含手续费；
+    只买入边际成本 (两腿每份成本之和) 低于 threshold_cost 的部分。
+    """
+    if not len(ladders_a): return np.zeros((0, 5))
+    price_a, size_a = ladder_matrix(ladders_a)
+    price_b, size_b = ladder_matrix(ladders_b)
+    cost_a, cost_b = unit_cost(price_a, fee_a), unit_cost(price_b, fee_b)
+    cum_a, cum_b = np.cumsum(size_a, axis=1), np.cumsum(size_b, axis=1)
+
+    # 两边累计数量的并集为分段断点；每段内两条腿各自停留在某一档
+    upper = np.sort(np.concatenate([cum_a, cum_b], axis=1), axis=1)
+    lower = np.concatenate([np.zeros((len(upper), 1)), upper[:, :-1]], axis=1)
+    length = upper - lower
+    mid = (lower + upper) / 2
+    level_a = (cum_a[:, None, :] <= mid[:, :, None]).sum(axis=2)
+    level_b = (cum_b[:, None, :] <= mid[:, :, None]).sum(axis=2)
+    # 超出某条腿全部深度的段不可成交
+    inside = (level_a < price_a.shape[1]) & (level_b < price_b.shape[1])
+    seg_a = np.take_along_axis(cost_a, np.minimum(level_a, price_a.shape[1] - 1), axis=1)
+    seg_b = np.take_along_axis(cost_b, np.minimum(level_b, price_b.shape[1] - 1), axis=1)
+    ok = inside & np.isfinite(seg_a) & np.isfinite(seg_b) & (seg_a + seg_b < threshold_cost)
+    # 边际成本不减：第一个不可成交的 (非零长) 段之后全部停止
+    take = (np.cumsum(~ok & (length > 0), axis=1) == 0) & ok
+    filled = np.where(take, length, 0.0)
+    with np.errstate(invalid="ignore"):
+        spent_a = np.where(take, filled * seg_a, 0.0).sum(axis=1)
+        spent_b = np.where(take, filled * seg_b, 0.0).sum(axis=1)
+    shares = filled.sum(axis=1)
+    total = spent_a + spent_b
+    return np.column_stack([total, spent_a, spent_b, shares, shares - total])
@@ -0,0 +1,204 @@
+"""
+本地市场目录库 (SQLite)
+
+按 (平台, 市场 id) 保存紧凑市场记录 (records.py) 的入库格式，支持按水位线增量同步与过期清理；
+同时保存最近一次对比表快照，新进程启动时无需等待网络即可渲染；
+以及人工确认过的模糊匹配配对，只有确认过的模糊配对才参与套利扫描。
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+from records import RECORD_TYPES, loads
+
+DEFAULT_PATH = os.environ.get(
+    "ARB_CATALOG_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "catalog.db")
+)
+FULL_SYNC_INTERVAL = 30 * 60   # 增量同步看不到的下架市场，靠定期全量同步清理
+
+
+def parse_ts(value):
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except (AttributeError, ValueError):
+        return None
+
+
+def updated_since(updated_at, since):
+    """updated_at / since 均为 ISO 时间字符串；缺失或无法解析时视为未更新"""
+    ts, mark = parse_ts(updated_at), parse_ts(since)
+    if ts is None or mark is None: return False
+    return ts >= mark
+
+
+class CatalogStore:
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS markets (
+                    venue TEXT NOT NULL,
+                    id TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    last_seen REAL NOT NULL,
+                    PRIMARY KEY (venue, id)
+                );
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                );
+                CREATE TABLE IF NOT EXISTS confirmed_pairs (
+                    poly_id TEXT NOT NULL,
+                    prob_id TEXT NOT NULL,
+                    confirmed_at REAL NOT NULL,
+                    PRIMARY KEY (poly_id, prob_id)
+                );
+                CREATE TABLE IF NOT EXISTS snapshot (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    created_at REAL NOT NULL,
+                    rows TEXT NOT NULL,
+                    arb TEXT NOT NULL,
+                    stats TEXT NOT NULL
+                );
+            """)
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(snapshot)")}
+            if "depth" not in columns:
+                # 旧库升级：后台扫描进程发布的卖盘
+                self._conn.execute("ALTER TABLE snapshot ADD COLUMN depth TEXT")
+            if "changes" not in columns:
+                # 旧库升级：相对上一份快照的机会变更流
+                self._conn.execute("ALTER TABLE snapshot ADD COLUMN changes TEXT")
+
+    def _get_meta(self, key):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        self._conn.execute(
+            "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, str(value)),
+        )
+
+    def watermark(self, venue):
+        """最近一次完整同步看到的最大 updatedAt (ISO 字符串)"""
+        with self._lock:
+            return self._get_meta(f"{venue}:watermark")
+
+    def full_sync_due(self, venue):
+        with self._lock:
+            last_full = self._get_meta(f"{venue}:last_full_sync")
+            has_watermark = self._get_meta(f"{venue}:watermark") is not None
+        return not has_watermark or last_full is None or time.time() - float(last_full) > FULL_SYNC_INTERVAL
+
+    def apply(self, venue, markets, synced_at, full=False, complete=True):
+        """
+        合并一次同步结果 (PolyMarket / ProbMarket 记录)：已关闭/下架的市场删除，其余按 id upsert。
+        full=True 表示这是完整的活跃市场列表，本次未出现的市场一并清理；
+        complete=False (抓取中途失败) 时不推进水位线。
+        """
+        upserts, removed = [], []
+        latest = None
+        for m in markets:
+            if m.closed is True or m.active is False:
+                removed.append((venue, m.id))
+            else:
+                upserts.append((venue, m.id, json.dumps(m.to_payload()), synced_at))
+            updated = m.updated_at
+            if updated and (latest is None or (parse_ts(updated) or 0) > (parse_ts(latest) or 0)):
+                latest = updated
+
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO markets (venue, id, payload, last_seen) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(venue, id) DO UPDATE SET payload = excluded.payload, last_seen = excluded.last_seen",
+                upserts,
+            )
+            self._conn.executemany("DELETE FROM markets WHERE venue = ? AND id = ?", removed)
+            if full:
+                self._conn.execute("DELETE FROM markets WHERE venue = ? AND last_seen < ?", (venue, synced_at))
+                self._set_meta(f"{venue}:last_full_sync", synced_at)
+            if complete:
+                previous = self._get_meta(f"{venue}:watermark")
+                if latest and (full or previous is None or (parse_ts(latest) or 0) > (parse_ts(previous) or 0)):
+                    self._set_meta(f"{venue}:watermark", latest)
+                elif full and previous is None:
+                    self._set_meta(f"{venue}:watermark", datetime.fromtimestamp(synced_at, timezone.utc).isoformat())
+
+    def load(self, venue):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT payload FROM markets WHERE venue = ? ORDER BY rowid", (venue,)
+            ).fetchall()
+        record = RECORD_TYPES[venue]
+        return [record.from_api(loads(payload)) for (payload,) in rows]
+
+    def save_snapshot(self, rows, arb, stats, depth=None, changes=None):
+        """
+        depth 为 "poly:<token>" / "prob:<token>" -> 卖盘 [(price, size), ...]，由后台扫描进程提供；
+        changes 为相对上一份快照的机会变更流 (delta.py)。
+        """
+        created_at = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO snapshot (id, created_at, rows, arb, stats, depth, changes) VALUES (1, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET created_at = excluded.created_at, rows = excluded.rows, "
+                "arb = excluded.arb, stats = excluded.stats, depth = excluded.depth, changes = excluded.changes",
+                (created_at, json.dumps(rows), json.dumps(arb), json.dumps(stats), json.dumps(depth or {}),
+                 json.dumps(changes or [])),
+            )
+        return created_at
+
+    def snapshot_created_at(self):
+        with self._lock:
+            row = self._conn.execute("SELECT created_at FROM snapshot WHERE id = 1").fetchone()
+        return row[0] if row else None
+
+    def load_snapshot(self):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT created_at, rows, arb, stats, depth, changes FROM snapshot WHERE id = 1").fetchone()
+        if row is None: return None
+        created_at, rows, arb, stats, depth, changes = row
+        return {
+            "created_at": created_at, "rows": json.loads(rows), "arb": json.loads(arb),
+            "stats": json.loads(stats), "depth": json.loads(depth or "{}"), "changes": json.loads(changes or "[]"),
+        }
+
+    def confirmed_pairs(self):
+        """人工确认过的模糊配对 {(poly id, prob id), ...}"""
+        with self._lock:
+            return set(self._conn.execute("SELECT poly_id, prob_id FROM confirmed_pairs").fetchall())
+
+    def confirm_pair(self, poly_id, prob_id, confirmed=True):
+        """确认 (或撤销确认) 一个模糊配对；下一轮刷新生效"""
+        with self._lock, self._conn:
+            if confirmed:
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO confirmed_pairs (poly_id, prob_id, confirmed_at) VALUES (?, ?, ?)",
+                    (poly_id, prob_id, time.time()),
+                )
+            else:
+                self._conn.execute("DELETE FROM confirmed_pairs WHERE poly_id = ? AND prob_id = ?", (poly_id, prob_id))
+
+    def set_heartbeat(self, interval):
+        """后台扫描进程每轮调用，页面据此判断是否由扫描进程负责刷新"""
+        with self._lock, self._conn:
+            self._set_meta("scanner:heartbeat", time.time())
+            self._set_meta("scanner:interval", interval)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def scanner_alive(self):
+        with self._lock:
+            beat = self._get_meta("scanner:heartbeat")
+            interval = self._get_meta("scanner:interval")
+        if beat is None: return False
+        return time.time() - float(beat) < 3 * float(interval or 0) + 30
@@ -0,0 +1,873 @@
+"""
+套利扫描核心逻辑 (不依赖 Streamlit)
+
+目录抓取与同步、批量行情、盘口深度、市场匹配与对比表生成，以及把这些阶段重叠起来的流水线刷新。
+Streamlit 页面 (app.py) 与后台扫描进程 (scanner.py) 共用本模块；
+进程内的共享资源 (连接池、目录库、匹配引擎等) 以单例形式懒加载。
+"""
+import functools
+import heapq
+import itertools
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+from book_cache import TTLCache
+from book_stream import StreamManager
+from capacity import FEE_RATES, solve_capacity
+from catalog_store import CatalogStore, updated_since
+from delta import DeltaEngine
+from history import KIND_DEPTH, SpreadHistory, arb_fields
+from matching import MatchEngine, StreamingMatcher
+from metrics import Metrics
+from records import PolyMarket, ProbMarket, loads
+from scheduler import DeadlineExceeded, RequestScheduler
+
+# --- 关键配置：伪装成浏览器 (User-Agent) ---
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+    "Accept": "application/json",
+    "Referer": "https://probable.markets/",
+    "Origin": "https://probable.markets"
+}
+
+# 并发抓取配置：ARB_SEQUENTIAL_FETCH=1 时回退为逐页顺序抓取
+CONCURRENT_FETCH = os.environ.get("ARB_SEQUENTIAL_FETCH", "0") != "1"
+PAGE_WINDOW = 8          # 每个平台同时在途的分页请求数
+POLY_PAGE_SIZE = 500
+PROB_PAGE_SIZE = 100
+
+# 接口地址：可用环境变量指向本地回放服务 (bench/replay_server.py)，离线基准测试不访问线上
+GAMMA_API = os.environ.get("ARB_GAMMA_API", "https://gamma-api.polymarket.com")
+PROB_MARKET_API = os.environ.get("ARB_PROB_MARKET_API", "https://market-api.probable.markets/public/api/v1")
+POLY_CLOB = os.environ.get("ARB_POLY_CLOB", "https://clob.polymarket.com")
+PROB_API = os.environ.get("ARB_PROB_API", "https://api.probable.markets/public/api/v1")
+
+# --- 埋点 (按接口/阶段统计，进程内共享) ---
+@functools.lru_cache(maxsize=None)
+def get_metrics():
+    return Metrics()
+
+# --- 请求调度 (按 host 令牌桶限流 + 429/5xx 退避重试，进程内共享) ---
+@functools.lru_cache(maxsize=None)
+def get_scheduler():
+    return RequestScheduler()
+
+# --- 共享连接池 (keep-alive 复用，进程内共享) ---
+@functools.lru_cache(maxsize=None)
+def get_http_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=PAGE_WINDOW * 4)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update(HEADERS)
+    # 每个响应自动计入请求数、状态码、流量与延迟
+    session.hooks["response"].append(get_metrics().observe_response)
+    return session
+
+def dedup_markets(markets):
+    """按市场 id 去重 (offset 分页期间列表变动会产生重复)，保持原有顺序"""
+    seen = set()
+    result = []
+    for m in markets:
+        if m.id:
+            if m.id in seen: continue
+            seen.add(m.id)
+        result.append(m)
+    return result
+
+def paginate(fetch_page, concurrent=True, window=PAGE_WINDOW, name="paginate", on_page=None):
+    """
+    逐页抓取直到遇到第一个空页。fetch_page(idx) 返回第 idx 页 (从 0 开始) 的列表。
+    并发模式下保持 window 个请求在途，结果仍按页号顺序拼接。
+    on_page(items) 在每个非空页到达时立即调用 (到达顺序，可能重复)，供流水线刷新提前匹配。
+    返回 (markets, error)，error 为导致提前终止的异常 (没有则为 None)；异常按 name 计入埋点。
+    """
+    pages = {}
+    if not concurrent:
+        idx = 0
+        try:
+            while True:
+                items = fetch_page(idx)
+                if not items: break
+                pages[idx] = items
+                if on_page: on_page(items)
+                idx += 1
+        except Exception as e:
+            get_metrics().record_exception(name, e)
+            return dedup_markets([m for i in sorted(pages) for m in pages[i]]), e
+        return dedup_markets([m for i in sorted(pages) for m in pages[i]]), None
+
+    end = None       # 第一个空页 (或失败页) 的页号
+    errors = {}
+    with ThreadPoolExecutor(max_workers=window) as pool:
+        pending = {}
+        next_idx = 0
+        while True:
+            while end is None and len(pending) < window:
+                pending[pool.submit(fetch_page, next_idx)] = next_idx
+                next_idx += 1
+            if not pending: break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                idx = pending.pop(fut)
+                try:
+                    items = fut.result()
+                except Exception as e:
+                    get_metrics().record_exception(name, e)
+                    items = None
+                    errors[idx] = e
+                if items:
+                    pages[idx] = items
+                    if on_page: on_page(items)
+                elif end is None or idx < end:
+                    end = idx
+            if end is not None:
+                # 已越过末页的请求能取消的直接取消
+                for fut, idx in list(pending.items()):
+                    if idx > end and fut.cancel(): del pending[fut]
+
+    last = end if end is not None else next_idx
+    markets = [m for i in range(last) for m in pages.get(i, [])]
+    return dedup_markets(markets), errors.get(end)
+
+# --- 1. 获取 Polymarket 数据 ---
+def get_poly_markets(session, concurrent=CONCURRENT_FETCH, since=None, on_page=None):
+    """
+    since 为 None 时全量抓取活跃市场；否则按 updatedAt 倒序只抓取 since 之后变动的市场
+    (包含刚关闭的市场，供本地库清理)。每页解析后立即投影为 PolyMarket 记录。
+    """
+    url = f"{GAMMA_API}/markets"
+    if since is None:
+        params = {"active": "true", "closed": "false", "limit": POLY_PAGE_SIZE}
+    else:
+        params = {"active": "true", "order": "updatedAt", "ascending": "false", "limit": POLY_PAGE_SIZE}
+
+    def fetch_page(idx):
+        resp = get_scheduler().request(session, "GET", url, params={**params, "offset": idx * POLY_PAGE_SIZE}, timeout=10)
+        # 重试后仍失败的页作为错误上报，不能当作末页 (否则目录被静默截断)
+        if resp.status_code != 200: raise requests.HTTPError(f"{resp.status_code} from {url}", response=resp)
+        data = [PolyMarket.from_api(m) for m in loads(resp.content)]
+        if since is not None:
+            # 整页都早于水位线时返回空页，分页随之结束
+            data = [m for m in data if updated_since(m.updated_at, since)]
+        return data
+
+    with get_metrics().stage("poly_catalog"):
+        return paginate(fetch_page, concurrent, name="poly_catalog", on_page=on_page)
+
+# --- 2. 获取 Probable 市场列表 ---
+def get_probable_markets(session, concurrent=CONCURRENT_FETCH, on_page=None):
+    url = f"{PROB_MARKET_API}/markets/"
+
+    def fetch_page(idx):
+        resp = get_scheduler().request(session, "GET", url, params={"page": idx + 1, "limit": PROB_PAGE_SIZE, "active": "true"}, timeout=10)
+        if resp.status_code != 200: raise requests.HTTPError(f"{resp.status_code} from {url}", response=resp)
+        return [ProbMarket.from_api(m) for m in loads(resp.content).get("markets", [])]
+
+    with get_metrics().stage("prob_catalog"):
+        return paginate(fetch_page, concurrent, name="prob_catalog", on_page=on_page)
+
+# --- 1+2. 两个平台同时同步到本地目录库 ---
+@functools.lru_cache(maxsize=None)
+def get_catalog_store():
+    return CatalogStore()
+
+def sync_catalogs(store, concurrent=CONCURRENT_FETCH, on_page=None):
+    """
+    Polymarket 按水位线增量同步 (定期全量一次以清理过期市场)；Probable 无增量接口，每次全量。
+    抓取失败时只合并已拿到的数据，不清理本地库。返回 (poly, prob, errors)。
+    on_page(venue, markets) 在每页到达时调用；Polymarket 增量同步时先用本地库中的目录调用一次
+    (增量页只含变动的市场)。
+    """
+    session = get_http_session()
+    poly_since = None if store.full_sync_due("poly") else store.watermark("poly")
+    started_at = time.time()
+    poly_page = prob_page = None
+    if on_page:
+        if poly_since is not None: on_page("poly", store.load("poly"))
+        poly_page = functools.partial(on_page, "poly")
+        prob_page = functools.partial(on_page, "prob")
+    if concurrent:
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            poly_fut = pool.submit(get_poly_markets, session, True, poly_since, poly_page)
+            prob_fut = pool.submit(get_probable_markets, session, True, prob_page)
+            poly, poly_err = poly_fut.result()
+            prob, prob_err = prob_fut.result()
+    else:
+        poly, poly_err = get_poly_markets(session, False, poly_since, poly_page)
+        prob, prob_err = get_probable_markets(session, False, prob_page)
+
+    with get_metrics().stage("catalog_store"):
+        store.apply("poly", poly, started_at, full=poly_since is None and poly_err is None, complete=poly_err is None)
+        store.apply("prob", prob, started_at, full=prob_err is None, complete=prob_err is None)
+        poly, prob = store.load("poly"), store.load("prob")
+
+    errors = []
+    if poly_err: errors.append(f"Polymarket 数据拉取失败: {poly_err}")
+    if prob_err: errors.append(f"Probable 列表拉取失败: {prob_err}")
+    return poly, prob, errors
+
+# --- 3. 批量行情层 (多 token 接口 + 自适应分块 + 失败分块重试) ---
+BULK_TARGET_LATENCY = 1.0    # 单个分块期望耗时 (秒)，据此放大/缩小分块
+BULK_MAX_RETRIES = 2
+BULK_UNSUPPORTED_TTL = 600   # 批量接口返回 405 后多久 (秒) 再试一次批量请求
+
+class AdaptiveChunker:
+    """根据观测到的延迟与失败动态调整单次批量请求携带的 token 数"""
+    def __init__(self, initial, min_size, max_size):
+        self.size = initial
+        self.min_size = min_size
+        self.max_size = max_size   # 接口 payload 上限
+        self.lock = threading.Lock()
+
+    def split(self, items):
+        size = self.size
+        return [items[i:i+size] for i in range(0, len(items), size)]
+
+    def observe(self, n, latency, ok):
+        with self.lock:
+            if not ok:
+                self.size = max(self.min_size, self.size // 2)
+            elif n >= self.size and latency < BULK_TARGET_LATENCY / 2:
+                self.size = min(self.max_size, int(self.size * 1.5) + 1)
+            elif latency > BULK_TARGET_LATENCY:
+                self.size = max(self.min_size, int(self.size * 0.7))
+
+@functools.lru_cache(maxsize=None)
+def get_chunkers():
+    # 跨 rerun 保留观测结果
+    return {
+        "prob_prices": AdaptiveChunker(50, 5, 200),
+        "poly_books": AdaptiveChunker(100, 10, 500),
+        "prob_books": AdaptiveChunker(50, 5, 200),
+    }
+
+class BulkJob:
+    """
+    一个平台一类数据的批量请求。parse(resp_json, chunk) 返回 {token_id: value}；
+    fallback(session, token_id) 用于批量接口不存在 (404/405) 时逐个请求。
+    405 说明接口确实不支持 POST，之后 BULK_UNSUPPORTED_TTL 秒内该 url 直接逐个请求；
+    404 可能只是网关/部署的临时问题，只对当前分块降级。
+    priorities 为 {token_id: 优先级}，数值高的 token 先请求 (未给出时按 items 顺序)。
+    """
+    unsupported = {}   # url -> 降级到期时间 (monotonic)，已确认不支持批量接口
+
+    def __init__(self, url, items, make_payload, parse, chunker, concurrency, fallback=None, priorities=None):
+        self.url = url
+        self.items = list(dict.fromkeys(t for t in items if t))
+        self.priorities = priorities or {}
+        if self.priorities:
+            self.items.sort(key=lambda t: self.priorities.get(t, 0.0), reverse=True)
+        self.make_payload = make_payload
+        self.parse = parse
+        self.chunker = chunker
+        self.concurrency = concurrency
+        self.fallback = fallback
+        self.results = {}
+        self.failed = []
+
+    def chunk_priority(self, chunk):
+        return max((self.priorities.get(t, 0.0) for t in chunk), default=0.0)
+
+    def fetch_chunk(self, session, chunk, deadline=None):
+        if BulkJob.unsupported.get(self.url, 0) > time.monotonic():
+            return self.fetch_one_by_one(session, chunk, deadline), None
+        # 限流与 429/5xx 重试由调度器负责
+        resp = get_scheduler().request(session, "POST", self.url, json=self.make_payload(chunk), timeout=5, deadline=deadline)
+        if resp.status_code in (404, 405) and self.fallback:
+            if resp.status_code == 405:
+                BulkJob.unsupported[self.url] = time.monotonic() + BULK_UNSUPPORTED_TTL
+            return self.fetch_one_by_one(session, chunk, deadline), None
+        if resp.status_code != 200:
+            raise requests.HTTPError(f"{resp.status_code} from {self.url}", response=resp)
+        # 分块大小只参考最后一次请求本身的耗时，不含限流等待
+        return self.parse(loads(resp.content), chunk), resp.elapsed.total_seconds()
+
+    def fetch_one_by_one(self, session, chunk, deadline=None):
+        results = {}
+        for token_id in chunk:
+            if deadline is not None and time.monotonic() >= deadline: break
+            value = self.fallback(session, token_id)
+            if value is not None: results[token_id] = value
+        return results
+
+def run_bulk(jobs, on_progress=None, max_retries=BULK_MAX_RETRIES, deadline=None):
+    """
+    并发执行多个 BulkJob 的所有分块。分块进入按优先级排序的队列 (优先级高者先发)，
+    每个 job 最多 job.concurrency 个分块在途；失败的分块按当前 (已缩小的) 分块大小重新切分，
+    以原优先级重新排队，成功的分块不会重发。deadline (time.monotonic 时刻) 到期后不再发起新分块，
+    仍在途或未发出的 token 计入 job.failed。每完成一个分块调用 on_progress(done_tokens, total_tokens)。
+    """
+    session = get_http_session()
+    total = sum(len(job.items) for job in jobs)
+    done = 0
+    queue, seq = [], itertools.count()
+
+    def enqueue(job, chunk, attempt):
+        heapq.heappush(queue, (-job.chunk_priority(chunk), next(seq), job, chunk, attempt))
+
+    for job in jobs:
+        for chunk in job.chunker.split(job.items): enqueue(job, chunk, 0)
+
+    inflight = {id(job): 0 for job in jobs}
+    pending = {}
+    pool = ThreadPoolExecutor(max_workers=max(1, sum(job.concurrency for job in jobs)))
+    try:
+        while queue or pending:
+            expired = deadline is not None and time.monotonic() >= deadline
+            held = []
+            while queue:
+                item = heapq.heappop(queue)
+                _, _, job, chunk, attempt = item
+                if expired:
+                    job.failed.extend(chunk)
+                    done += len(chunk)
+                elif inflight[id(job)] >= job.concurrency:
+                    held.append(item)
+                else:
+                    inflight[id(job)] += 1
+                    pending[pool.submit(job.fetch_chunk, session, chunk, deadline)] = (job, chunk, attempt)
+            for item in held: heapq.heappush(queue, item)
+            if not pending: break
+
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            finished, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not finished:
+                # 到期：放弃仍在途的分块，队列中剩余的分块在下一轮统一计入失败
+                for job, chunk, _ in pending.values():
+                    job.failed.extend(chunk)
+                    done += len(chunk)
+                pending.clear()
+                continue
+            for fut in finished:
+                job, chunk, attempt = pending.pop(fut)
+                inflight[id(job)] -= 1
+                try:
+                    values, latency = fut.result()
+                except Exception as e:
+                    get_metrics().record_exception(f"bulk{job.url[job.url.rfind('/'):]}", e)
+                    job.chunker.observe(len(chunk), 0.0, ok=False)
+                    if attempt < max_retries and not isinstance(e, DeadlineExceeded):
+                        for sub in job.chunker.split(chunk): enqueue(job, sub, attempt + 1)
+                        continue
+                    job.failed.extend(chunk)
+                else:
+                    job.results.update(values)
+                    if latency is not None: job.chunker.observe(len(chunk), latency, ok=True)
+                done += len(chunk)
+            if on_progress and total: on_progress(done, total)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+    return jobs
+
+def parse_books(data, chunk):
+    """批量盘口接口返回 list[book] (以 asset_id/token_id 标识) 或 {token_id: book}"""
+    if isinstance(data, dict):
+        return {t: data[t] for t in chunk if t in data}
+    return {(b.get("asset_id") or b.get("token_id")): b for b in data if isinstance(b, dict)}
+
+def parse_prices(data, chunk):
+    return {t: data[t] for t in chunk if t in data}
+
+def get_book(session, url, token_id):
+    try:
+        resp = get_scheduler().request(session, "GET", url, params={"token_id": token_id}, timeout=3)
+        if resp.status_code == 200: return loads(resp.content)
+    except Exception as e:
+        get_metrics().record_exception("get_book", e)
+    return None
+
+def get_probable_prices_batch(token_ids):
+    """返回 ({token_id: {"BUY": ...}}, 重试后仍失败的 token 列表)；接口未返回的 token 不算失败"""
+    if not token_ids: return {}, []
+    job = BulkJob(
+        f"{PROB_API}/prices", token_ids,
+        make_payload=lambda chunk: [{"token_id": t, "side": "BUY"} for t in chunk],
+        parse=parse_prices,
+        chunker=get_chunkers()["prob_prices"],
+        concurrency=4,
+    )
+    run_bulk([job])
+    return job.results, job.failed
+
+# --- 4. 真实深度计算函数 (返回详细数据) ---
+POLY_BOOK_CONCURRENCY = 8    # 每个平台同时在途的批量盘口请求上限
+PROB_BOOK_CONCURRENCY = 4
+# 深度扫描的时间预算 (秒)：到期后不再发起新请求，剩余候选显示为未计算
+DEPTH_DEADLINE = float(os.environ.get("ARB_DEPTH_DEADLINE", "20"))
+
+# 盘口缓存：按 token 共享，ARB_BOOK_TTL 秒后过期，最多 ARB_BOOK_CACHE_SIZE 条 (LRU 淘汰)
+BOOK_CACHE_TTL = float(os.environ.get("ARB_BOOK_TTL", "15"))
+BOOK_CACHE_SIZE = int(os.environ.get("ARB_BOOK_CACHE_SIZE", "20000"))
+
+@functools.lru_cache(maxsize=None)
+def get_book_cache():
+    return TTLCache(BOOK_CACHE_TTL, BOOK_CACHE_SIZE)
+
+def ask_levels(book):
+    """盘口 JSON 压缩为卖盘 [(price, size), ...]；Polymarket 档位为 {price, size}，Probable 为 [price, size]"""
+    levels = []
+    for level in book.get("asks", []):
+        try:
+            if isinstance(level, dict):
+                levels.append((float(level["price"]), float(level["size"])))
+            else:
+                levels.append((float(level[0]), float(level[1])))
+        except Exception as e:
+            get_metrics().record_exception("ask_levels", e)
+    return levels
+
+def books_job(venue, token_ids, priorities=None):
+    """批量 /books 请求；批量接口不可用时逐个 GET /book。priorities 为 {token_id: 优先级}"""
+    base = POLY_CLOB if venue == "poly" else PROB_API
+    return BulkJob(
+        f"{base}/books", token_ids,
+        make_payload=lambda chunk: [{"token_id": t} for t in chunk],
+        parse=parse_books,
+        chunker=get_chunkers()[f"{venue}_books"],
+        concurrency=POLY_BOOK_CONCURRENCY if venue == "poly" else PROB_BOOK_CONCURRENCY,
+        fallback=lambda session, t: get_book(session, f"{base}/book", t),
+        priorities=priorities,
+    )
+
+def fetch_books(venue, token_ids):
+    """拉取盘口快照，返回 {token_id: book}"""
+    job = books_job(venue, token_ids)
+    run_bulk([job])
+    return job.results
+
+@functools.lru_cache(maxsize=None)
+def get_stream_manager():
+    # 断档后通过 REST 批量接口重建快照
+    return StreamManager(snapshot_fns={
+        "poly": lambda tokens: fetch_books("poly", tokens),
+        "prob": lambda tokens: fetch_books("prob", tokens),
+    })
+
+def apply_live_prices(frame, live):
+    """用实时盘口的卖一价覆盖目录中的 (可能已过期的) 价格，返回新的列式表"""
+    frame = frame.copy()
+    for venue, side in (("poly", "yes"), ("poly", "no"), ("prob", "yes"), ("prob", "no")):
+        store = live.store(venue)
+        if store is None: continue
+        levels = [store.best_ask(t) if t else None for t in frame[f"{venue}_{side}_id"]]
+        live_px = np.array([level[0] if level else np.nan for level in levels], dtype="float64")
+        col = f"{venue}_{side}"
+        frame[col] = np.where(np.isnan(live_px), frame[col].to_numpy(), live_px)
+    return frame
+
+def get_ask_ladders(keys, on_progress=None, priorities=None, deadline=None):
+    """
+    keys 为 "poly:<token>" / "prob:<token>"；先查共享盘口缓存，未命中的 token
+    跨平台同时通过批量 /books 接口按 priorities ({key: 优先级}) 从高到低抓取，
+    deadline 到期后停止。抓取失败或未来得及抓取的 token 不出现在返回值中。
+    """
+    priorities = priorities or {}
+
+    def load(missing):
+        jobs = {}
+        for venue in ("poly", "prob"):
+            tokens = {k.split(":", 1)[1]: priorities.get(k, 0.0) for k in missing if k.startswith(f"{venue}:")}
+            jobs[venue] = books_job(venue, list(tokens), priorities=tokens)
+        with get_metrics().stage("depth_books"):
+            run_bulk(list(jobs.values()), on_progress=on_progress, deadline=deadline)
+        return {
+            f"{venue}:{token_id}": ask_levels(book)
+            for venue, job in jobs.items() for token_id, book in job.results.items()
+        }
+
+    return get_book_cache().get_many(keys, load)
+
+def calculate_arb_capacity_batch(pairs, on_progress=None, live=None, priorities=None, deadline=None,
+                                 threshold_cost=1.0):
+    """
+    批量深度引擎：pairs 为 [(poly_token_id, prob_token_id), ...]。
+    live 为 StreamManager 时优先读取本地实时盘口；其余 token 走共享盘口缓存，
+    缓存未命中的跨候选去重后批量抓取，每完成一个分块调用 on_progress(done, total)。
+    priorities (与 pairs 对齐，通常为 raw_profit) 决定请求顺序，未给出时按 pairs 顺序；
+    deadline (time.monotonic 时刻) 到期后不再发起请求，固定的接口预算优先用在收益最高的候选上。
+    两条腿的完整卖盘交给 capacity.solve_capacity 一次性求解：只买入两腿每份成本 (含手续费) 之和
+    低于 threshold_cost 的部分。返回与 pairs 一一对应的五元组
+    (总投入, Poly端投入, Prob端投入, 份数, 预期利润)；任一侧盘口未取得时整组为 None (而非 0)。
+    """
+    live_poly = live.store("poly") if live else None
+    live_prob = live.store("prob") if live else None
+    if priorities is None: priorities = [-i for i in range(len(pairs))]
+
+    def live_ladder(store, token_id):
+        # 缺少 token 的一侧没有可买的盘口，视为空卖盘；未订阅或未同步时返回 None
+        if not token_id: return []
+        return store.ask_ladder(token_id) if store is not None else None
+
+    live_ladders = []
+    key_priority = {}
+    for (poly_id, prob_id), priority in zip(pairs, priorities):
+        lad_poly, lad_prob = live_ladder(live_poly, poly_id), live_ladder(live_prob, prob_id)
+        live_ladders.append((lad_poly, lad_prob))
+        for key, lad in ((f"poly:{poly_id}", lad_poly), (f"prob:{prob_id}", lad_prob)):
+            if lad is None: key_priority[key] = max(priority, key_priority.get(key, priority))
+    keys = sorted(key_priority, key=key_priority.get, reverse=True)
+
+    with get_metrics().stage("depth_scan"):
+        ladders = get_ask_ladders(keys, on_progress, key_priority, deadline) if keys else {}
+
+    known, side_poly, side_prob = [], [], []
+    for i, ((poly_id, prob_id), (lad_poly, lad_prob)) in enumerate(zip(pairs, live_ladders)):
+        if lad_poly is None: lad_poly = ladders.get(f"poly:{poly_id}")
+        if lad_prob is None: lad_prob = ladders.get(f"prob:{prob_id}")
+        if lad_poly is None or lad_prob is None: continue
+        known.append(i)
+        side_poly.append(lad_poly)
+        side_prob.append(lad_prob)
+
+    results = [None] * len(pairs)
+    with get_metrics().stage("depth_solve"):
+        solved = solve_capacity(side_poly, side_prob, threshold_cost, FEE_RATES["poly"], FEE_RATES["prob"])
+    for i, row in zip(known, solved.tolist()):
+        results[i] = tuple(row)
+    return [r if r is not None else (None,) * 5 for r in results]
+
+# --- 5. 列式套利扫描 ---
+ARB_COLUMNS = [
+    "question", "outcome_a", "outcome_b",
+    "poly_yes", "poly_no", "prob_yes", "prob_no",
+    "prob_yes_id", "prob_no_id", "poly_yes_id", "poly_no_id", "match",
+]
+
+def build_arb_frame(raw_arb_data):
+    """套利原始数据转为列式存储 (每次加载数据时一次)，并预先生成两种策略的名称"""
+    frame = pd.DataFrame(raw_arb_data, columns=ARB_COLUMNS)
+    for col in ("poly_yes", "poly_no", "prob_yes", "prob_no"):
+        frame[col] = frame[col].astype("float64")
+    for col in ("prob_yes_id", "prob_no_id", "poly_yes_id", "poly_no_id"):
+        # 缺失的 token id 保持为 None (而非 NaN)，下游按真值判断
+        frame[col] = frame[col].astype(object).where(frame[col].notna(), None)
+    # 旧快照没有匹配标记
+    frame["match"] = frame["match"].fillna("")
+    frame["strategy_a"] = "🔵Poly(" + frame["outcome_a"] + ") + 🟠Prob(" + frame["outcome_b"] + ")"
+    frame["strategy_b"] = "🔵Poly(" + frame["outcome_b"] + ") + 🟠Prob(" + frame["outcome_a"] + ")"
+    return frame
+
+def scan_arbitrage(frame, threshold_cost):
+    """
+    一次向量化计算策略 A (Poly Yes + Prob No) 与 B (Poly No + Prob Yes) 的成本与收益率，
+    按成本阈值过滤后按收益率降序返回候选，附带两侧下单的 token id。
+    """
+    cost = np.column_stack([
+        frame["poly_yes"].to_numpy() + frame["prob_no"].to_numpy(),
+        frame["poly_no"].to_numpy() + frame["prob_yes"].to_numpy(),
+    ]).ravel()
+    # 成本为 0 说明两侧都没有价格，不构成机会
+    hit = np.flatnonzero((cost > 0) & (cost < threshold_cost))
+    rows, is_b, cost = hit // 2, (hit % 2).astype(bool), cost[hit]
+    profit = (1 - cost) / cost
+    order = np.argsort(-profit, kind="stable")
+    rows, is_b, cost, profit = rows[order], is_b[order], cost[order], profit[order]
+
+    def pick(col_a, col_b):
+        return np.where(is_b, frame[col_b].to_numpy()[rows], frame[col_a].to_numpy()[rows])
+
+    return pd.DataFrame({
+        "question": frame["question"].to_numpy()[rows],
+        "strat": np.where(is_b, "B", "A"),
+        "strategy_name": pick("strategy_a", "strategy_b"),
+        "cost": cost,
+        "raw_profit": profit,
+        "poly_side_id": pick("poly_yes_id", "poly_no_id"),
+        "prob_side_id": pick("prob_no_id", "prob_yes_id"),
+        "match": frame["match"].to_numpy()[rows],
+    })
+
+# --- 6. 市场匹配与对比表 ---
+@functools.lru_cache(maxsize=None)
+def get_matcher():
+    # 跨刷新复用，保留模糊匹配的打分缓存
+    return MatchEngine()
+
+@functools.lru_cache(maxsize=None)
+def get_delta_engine():
+    # 跨刷新复用，保留每个市场上一轮的行、套利数据与机会
+    return DeltaEngine(build_market_row, same_market_inputs)
+
+@functools.lru_cache(maxsize=None)
+def get_spread_history():
+    return SpreadHistory()
+
+def record_spread_history(ts, updated, depth_records=()):
+    """
+    写入价差历史：updated 为 process_markets 返回的变化市场 (价格记录)，
+    depth_records 为 [(市场名称, {"depth_a"/"depth_b": 容量}), ...] (深度记录)。写入失败不影响刷新。
+    """
+    try:
+        history = get_spread_history()
+        history.append(ts, [(question, arb_fields(arb)) for question, arb in updated.values()])
+        history.append(ts, list(depth_records), KIND_DEPTH)
+    except OSError as e:
+        get_metrics().record_exception("spread_history", e)
+
+def same_market_inputs(old, new):
+    """(poly_m, prob_m, prob_raw_yes, prob_raw_no, match, tradable) 中 build_market_row 读取的字段是否都未变"""
+    a, b, yes, no, match, tradable = old
+    c, d, yes2, no2, match2, tradable2 = new
+    return (yes == yes2 and no == no2 and a.prices == c.prices and b.id == d.id
+            and match == match2 and tradable == tradable2
+            and a.liquidity == c.liquidity and a.volume == c.volume
+            and b.liquidity == d.liquidity and b.volume == d.volume
+            and a.question == c.question and a.outcomes == c.outcomes
+            and a.yes_token == c.yes_token and a.no_token == c.no_token
+            and b.yes_token == d.yes_token and b.no_token == d.no_token)
+
+def match_label(tier, score, confirmed):
+    """匹配标记：完全相同 / 规范化后相同为空；模糊匹配标出分数与是否已人工确认"""
+    if tier in ("exact", "normalized"): return ""
+    return f"🔀 模糊 {score:.0f} ✓" if confirmed else f"🔀 模糊 {score:.0f} 待确认"
+
+def build_market_row(poly_m, prob_m, prob_raw_yes, prob_raw_no, match="", tradable=True):
+    """
+    单个匹配市场的对比表行与套利原始数据 (两侧都没有有效价格，或未确认的模糊配对 tradable=False 时为 None)。
+    match 为匹配标记 (match_label)，写在行末与套利数据中。
+    """
+    name_a = poly_m.outcomes[0]
+    name_b = poly_m.outcomes[1]
+    
+    prices = poly_m.prices
+    if prices is None:
+        poly_p_yes, poly_p_no = 0.0, 0.0
+        poly_price_str = "Err"
+    else:
+        poly_p_yes = prices[0] if len(prices) > 0 else 0.0
+        poly_p_no = prices[1] if len(prices) > 1 else 0.0
+        poly_price_str = f"{name_a}: {poly_p_yes:.1%} / {name_b}: {poly_p_no:.1%}"
+
+    try:
+        prob_p_yes = float(prob_raw_yes)
+        prob_p_no = float(prob_raw_no)
+        prob_price_str = f"{name_a}: {prob_p_yes:.1%} / {name_b}: {prob_p_no:.1%}"
+    except Exception as e:
+        get_metrics().record_exception("prob_price", e)
+        prob_p_yes, prob_p_no = 0.0, 0.0
+        prob_price_str = "N/A"
+
+    row = [
+        poly_m.question,
+        poly_price_str, prob_price_str,
+        poly_m.liquidity, poly_m.volume,
+        prob_m.liquidity, prob_m.volume,
+        match,
+    ]
+    arb = None
+    if tradable and (poly_p_yes > 0.005 or poly_p_no > 0.005) and (prob_p_yes > 0.005 or prob_p_no > 0.005): 
+        arb = {
+            "question": poly_m.question,
+            "outcome_a": name_a,
+            "outcome_b": name_b,
+            "poly_yes": poly_p_yes,
+            "poly_no": poly_p_no,
+            "prob_yes": prob_p_yes,
+            "prob_no": prob_p_no,
+            "prob_yes_id": prob_m.yes_token,
+            "prob_no_id": prob_m.no_token,
+            "poly_yes_id": poly_m.yes_token,
+            "poly_no_id": poly_m.no_token,
+            "match": match,
+        }
+    return row, arb
+
+def process_markets(poly, prob, on_status=None, timings=None, prices=None, confirmed=None):
+    """
+    匹配相同市场、同步 Probable 价格并组装对比表。不依赖 Streamlit 会话，可在后台线程运行。
+    返回快照 dict: rows (对比表行)、arb (套利原始数据)、stats (计数)、
+    changes (相对上一轮的机会变更流，见 delta.py)、updated (本轮重算或不再匹配的市场，见 DeltaEngine.update)。
+    只有价格等输入变化的市场才重新生成行与机会，其余复用上一轮的结果。
+    传入 timings (dict) 时写入各阶段耗时 (秒)：matching / price_sync / table_build。
+    prices 为本轮已取得的 Probable 价格 ({token: {"BUY": ...}}，如流水线刷新途中取到的)，只补取其余 token。
+    价格全部拉取失败时返回 None (不生成全是空价格的快照，也不更新增量状态)，调用方保留上一份快照；
+    部分分块失败时，价格没取到的市场沿用上一轮的行与机会 (不当作价格归零，不产生消失 / 出现的变更)。
+    confirmed 为人工确认过的模糊配对 {(poly id, prob id)} (CatalogStore.confirmed_pairs)；未确认的模糊配对
+    只出现在对比表中 (带标记)，不进入套利数据，stats["fuzzy_pairs"] 列出全部模糊配对供确认。
+    """
+    confirmed = confirmed or set()
+    if timings is None: timings = {}
+    t0 = time.perf_counter()
+    # [(poly_m, prob_m, score, tier), ...]，按问题排序
+    matched = get_matcher().match(poly, prob)
+    timings["matching"] = time.perf_counter() - t0
+    get_metrics().observe_stage("matching", timings["matching"])
+    stats = {
+        "poly": len(poly), "prob": len(prob), "match": len(matched),
+        "fuzzy": sum(1 for _, _, _, tier in matched if tier == "fuzzy"),
+        "fuzzy_pairs": [
+            {"poly_id": poly_m.id, "prob_id": prob_m.id, "poly_question": poly_m.question,
+             "prob_question": prob_m.question, "score": score,
+             "confirmed": (poly_m.id, prob_m.id) in confirmed}
+            for poly_m, prob_m, score, tier in matched if tier == "fuzzy"
+        ],
+    }
+    if not matched:
+        rows, arb, changes, updated = get_delta_engine().update([])
+        stats["changed"] = 0
+        return {"rows": rows, "arb": arb, "stats": stats, "changes": changes, "updated": updated}
+
+    if on_status: on_status(f"Step 3/4: 同步 {len(matched)} 个市场的价格...", 50)
+    t0 = time.perf_counter()
+
+    # token id 与价格已在入库时解析好 (records.py)，这里只收集需要同步价格的 Probable token
+    all_tokens_to_fetch = []
+    for _, prob_m, _, _ in matched:
+        if prob_m.yes_token: all_tokens_to_fetch.append(prob_m.yes_token)
+        if prob_m.no_token: all_tokens_to_fetch.append(prob_m.no_token)
+
+    price_data = dict(prices or {})
+    fetched, price_failed = get_probable_prices_batch([t for t in all_tokens_to_fetch if t not in price_data])
+    price_data.update(fetched)
+    if all_tokens_to_fetch and not price_data: return None
+    stats["price_failed"] = len(price_failed)
+    price_failed = set(price_failed)
+    keep = {
+        poly_m.id for poly_m, prob_m, _, _ in matched
+        if prob_m.yes_token in price_failed or prob_m.no_token in price_failed
+    } if price_failed else set()
+    timings["price_sync"] = time.perf_counter() - t0
+    get_metrics().observe_stage("price_sync", timings["price_sync"])
+    if on_status: on_status("Step 4/4: 生成对比表...", 75)
+    t0 = time.perf_counter()
+
+    def entries():
+        # 匹配是一对一的，按 Polymarket id 跟踪；输入未变的市场不重算 (same_market_inputs)
+        for poly_m, prob_m, score, tier in matched:
+            id_yes = prob_m.yes_token
+            id_no = prob_m.no_token
+            prob_raw_yes = price_data.get(id_yes, {}).get("BUY", "0") if id_yes else "0"
+            prob_raw_no = price_data.get(id_no, {}).get("BUY", "0") if id_no else "0"
+            # 模糊配对确认前不参与套利：措辞相近不代表是同一个市场
+            ok = tier != "fuzzy" or (poly_m.id, prob_m.id) in confirmed
+            yield poly_m.id, (poly_m, prob_m, prob_raw_yes, prob_raw_no, match_label(tier, score, ok), ok)
+
+    rows_data, raw_arb_data, changes, updated = get_delta_engine().update(entries(), keep)
+    stats["changed"] = len(updated)
+
+    timings["table_build"] = time.perf_counter() - t0
+    get_metrics().observe_stage("table_build", timings["table_build"])
+    return {"rows": rows_data, "arb": raw_arb_data, "stats": stats, "changes": changes, "updated": updated}
+
+# --- 7. 流水线刷新 ---
+PRICE_BATCH_PAIRS = 250      # 每批最多为多少个新配对取价
+PRICE_LINGER = 0.2           # 凑批等待时间 (秒)：配对到达较慢时不等满一批
+
+class PipelinedRefresh:
+    """
+    流水线刷新：两边目录的每一页到达即送入 StreamingMatcher，新配对进入 Probable 价格批量队列，
+    定价后立即生成对比表行 (rows_since 读取)；网络等待与匹配、取价、出表相互重叠。
+    目录抓取完毕后用完整目录再跑一次 process_markets (含模糊匹配与增量重算，复用途中取到的价格)，
+    得到最终快照；on_done(snap, errors) 在后台线程中调用。任一目录拉取失败时 snap 为 None：
+    sync_catalogs 会用本地库补齐失败的一侧，按它生成的快照并不新，不能以新的时间发布。
+    """
+    def __init__(self, store, concurrent=CONCURRENT_FETCH, on_done=None):
+        self.store = store
+        self.concurrent = concurrent
+        self.on_done = on_done
+        self.matcher = StreamingMatcher()
+        self.started_at = time.time()
+        self.first_row_at = None
+        self.done = threading.Event()
+        self.snap = None
+        self.errors = []
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._rows = []              # [(poly 市场 id, 行)]，同一市场更新时再次追加
+        self._prices = {}            # 途中取到的 Probable 价格
+        self._pages = {"poly": 0, "prob": 0}
+        self._matched = 0
+        self._catalogs_done = False
+
+    def start(self):
+        threading.Thread(target=self._run, name="pipelined-refresh", daemon=True).start()
+        return self
+
+    def progress(self):
+        with self._lock:
+            return {
+                "poly_pages": self._pages["poly"], "prob_pages": self._pages["prob"],
+                "matched": self._matched, "priced": len(self._rows),
+                "catalogs_done": self._catalogs_done, "elapsed": time.time() - self.started_at,
+            }
+
+    def rows_since(self, cursor):
+        """返回 (cursor 之后的新行 [(市场 id, 行)], 新 cursor)"""
+        with self._lock:
+            return self._rows[cursor:], len(self._rows)
+
+    def _on_page(self, venue, markets):
+        # 增量页里包含刚关闭/下架的市场 (供本地库清理)，不参与配对
+        pairs = self.matcher.add(venue, [m for m in markets if m.closed is not True and m.active is not False])
+        with self._lock:
+            self._pages[venue] += 1
+            self._matched += len(pairs)
+        for pair in pairs: self._queue.put(pair)
+
+    def _price_pairs(self):
+        """取价线程：凑批后一次批量取价，逐个生成对比表行"""
+        finished = False
+        while not finished:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + PRICE_LINGER
+            while len(batch) < PRICE_BATCH_PAIRS:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            if None in batch:
+                finished = True
+                batch = [pair for pair in batch if pair is not None]
+            if not batch: continue
+            tokens = [t for _, prob_m in batch for t in (prob_m.yes_token, prob_m.no_token) if t]
+            try:
+                prices, failed = get_probable_prices_batch(tokens)
+            except Exception as e:
+                get_metrics().record_exception("pipeline_prices", e)
+                continue
+            # 价格没取到的配对不出预览行，最终快照里由 process_markets 补取
+            failed = set(failed)
+            rows = []
+            for poly_m, prob_m in batch:
+                if prob_m.yes_token in failed or prob_m.no_token in failed: continue
+                raw = [prices.get(t, {}).get("BUY", "0") if t else "0" for t in (prob_m.yes_token, prob_m.no_token)]
+                rows.append((poly_m.id, build_market_row(poly_m, prob_m, *raw)[0]))
+            with self._lock:
+                self._prices.update(prices)
+                self._rows.extend(rows)
+                if self.first_row_at is None: self.first_row_at = time.time()
+
+    def _run(self):
+        pricer = threading.Thread(target=self._price_pairs, name="pipelined-prices", daemon=True)
+        pricer.start()
+        try:
+            poly, prob, self.errors = sync_catalogs(self.store, self.concurrent, on_page=self._on_page)
+        except Exception as e:
+            get_metrics().record_exception("pipeline", e)
+            poly, prob, self.errors = [], [], [f"目录同步失败: {e}"]
+        with self._lock:
+            self._catalogs_done = True
+        self._queue.put(None)
+        pricer.join()
+        try:
+            if not self.errors:
+                with self._lock:
+                    prices = dict(self._prices)
+                self.snap = process_markets(poly, prob, prices=prices, confirmed=self.store.confirmed_pairs())
+                if self.snap is None: self.errors = self.errors + ["Probable 价格拉取失败"]
+            if self.on_done: self.on_done(self.snap, self.errors)
+        except Exception as e:
+            get_metrics().record_exception("pipeline", e)
+            self.snap = None
+            self.errors = self.errors + [f"生成对比表失败: {e}"]
+        finally:
+            self.done.set()
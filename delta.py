@@ -0,0 +1,123 @@
+"""
+增量重算
+
+跨刷新保留每个匹配市场的上一份状态：输入 (Polymarket outcomePrices、Probable BUY 价格、
+token、流动性与成交量)、对比表行、套利原始数据和该市场上的套利机会。
+新一轮只逐字段比较输入，未变化的市场直接复用上一份结果；只有变化的市场重新生成行并重算机会，
+机会的出现 / 消失 / 成本移动作为变更流输出，下游 (深度扫描、告警) 只需处理这些市场。
+"""
+import threading
+
+FEED_THRESHOLD = 1.0     # 成本低于该值 (即收益率 > 0) 计为机会
+MOVE_EPSILON = 1e-9      # 成本变化小于该值不算移动
+
+
+def market_opportunities(arb, threshold_cost=FEED_THRESHOLD):
+    """
+    单个市场上的策略 A (Poly Yes + Prob No) 与 B (Poly No + Prob Yes)，口径与 core.scan_arbitrage 一致。
+    返回 {"A"/"B": (cost, profit, poly_side_id, prob_side_id)}，只含成本在 (0, threshold_cost) 内的策略。
+    """
+    if arb is None: return {}
+    opps = {}
+    for strat, poly_px, prob_px, poly_id, prob_id in (
+        ("A", arb["poly_yes"], arb["prob_no"], arb["poly_yes_id"], arb["prob_no_id"]),
+        ("B", arb["poly_no"], arb["prob_yes"], arb["poly_no_id"], arb["prob_yes_id"]),
+    ):
+        cost = poly_px + prob_px
+        if 0 < cost < threshold_cost:
+            opps[strat] = (cost, (1 - cost) / cost, poly_id, prob_id)
+    return opps
+
+
+def strategy_name(arb, strat):
+    a, b = arb["outcome_a"], arb["outcome_b"]
+    return f"🔵Poly({a}) + 🟠Prob({b})" if strat == "A" else f"🔵Poly({b}) + 🟠Prob({a})"
+
+
+def change_event(event, key, arb, strat, opp, prev=None):
+    cost, profit, poly_id, prob_id = opp
+    record = {
+        "event": event, "market": key, "question": arb["question"],
+        "strategy": strat, "strategy_name": strategy_name(arb, strat),
+        "cost": cost, "profit": profit, "poly_token_id": poly_id, "prob_token_id": prob_id,
+    }
+    if prev is not None:
+        record["prev_cost"], record["prev_profit"] = prev[0], prev[1]
+    return record
+
+
+class MarketState:
+    __slots__ = ("inputs", "row", "arb", "opps")
+
+    def __init__(self, inputs, row, arb, opps):
+        self.inputs = inputs
+        self.row = row
+        self.arb = arb
+        self.opps = opps
+
+
+class DeltaEngine:
+    """
+    update() 的输入为 [(key, inputs), ...]，key 为市场的稳定标识，inputs 为该市场本轮的输入 (元组)。
+    same(old_inputs, inputs) 判断输入是否未变；变化时调用 build(*inputs) 得到 (对比表行, 套利原始数据或 None)。
+    比较不为每个市场额外分配签名对象：目录很大时分配本身 (及其触发的 GC) 就会超过重算的开销。
+    实例在多次刷新之间复用 (core.get_delta_engine)。
+    """
+
+    def __init__(self, build, same, threshold_cost=FEED_THRESHOLD):
+        self.build = build
+        self.same = same
+        self.threshold_cost = threshold_cost
+        self._lock = threading.Lock()
+        self._state = {}         # key -> MarketState
+
+    def update(self, entries, keep=()):
+        with self._lock:
+            return self._update(entries, keep)
+
+    def _update(self, entries, keep):
+        """
+        keep 中的市场本轮输入不可信 (如价格请求失败)：已有上一份状态时原样沿用，不重算。
+        返回 (rows, arb, changes, updated)；rows / arb 按 entries 顺序，changes 为机会变更流，
+        updated 为 {key: (问题, 套利原始数据或 None)}，只含本轮重算或不再匹配 (套利数据为 None) 的市场。
+        """
+        previous = self._state
+        state = {}
+        rows, arb_data, changes, updated = [], [], [], {}
+        build, same = self.build, self.same
+        for key, inputs in entries:
+            old = previous.get(key)
+            if old is not None and (key in keep or same(old.inputs, inputs)):
+                current = old
+            else:
+                row, arb = build(*inputs)
+                current = MarketState(inputs, row, arb, market_opportunities(arb, self.threshold_cost))
+                updated[key] = (row[0], arb)
+                changes.extend(self._diff(key, old, current))
+            state[key] = current
+            rows.append(current.row)
+            if current.arb is not None: arb_data.append(current.arb)
+
+        # 本轮不再匹配的市场：其上的机会全部消失
+        removed = previous.keys() - state.keys()
+        for key in removed:
+            changes.extend(self._diff(key, previous[key], None))
+            updated[key] = (previous[key].row[0], None)
+
+        self._state = state
+        return rows, arb_data, changes, updated
+
+    @staticmethod
+    def _diff(key, old, new):
+        old_opps = old.opps if old is not None else {}
+        new_opps = new.opps if new is not None else {}
+        events = []
+        for strat in ("A", "B"):
+            before, after = old_opps.get(strat), new_opps.get(strat)
+            if before is None and after is not None:
+                events.append(change_event("appeared", key, new.arb, strat, after))
+            elif before is not None and after is None:
+                events.append(change_event("disappeared", key, old.arb, strat, before))
+            elif before is not None and abs(after[0] - before[0]) > MOVE_EPSILON:
+                events.append(change_event("moved", key, new.arb, strat, after, before))
+        return events
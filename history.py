@@ -0,0 +1,262 @@
+"""
+跨平台价差历史 (列式、只追加、按天分区)
+
+每一轮只为价格变化的市场 (delta.py 的 updated) 追加价格记录、为新算出深度的机会追加深度记录，
+未变化的市场不重复写入，查询时按"最后一个值一直有效"补齐。磁盘布局：
+
+    <root>/markets.txt              市场名称字典，第 n 行对应市场编号 n
+    <root>/2026-01-31/ts.f8         每条记录的时间 (unix 秒)
+    <root>/2026-01-31/market.u4     市场编号
+    <root>/2026-01-31/kind.u1       记录类型：价格 (KIND_PRICE) / 深度 (KIND_DEPTH)
+    <root>/2026-01-31/<field>.f4    各字段；价格记录中价格为 NaN 表示没有有效价格 (或已不再匹配)，
+                                    深度记录只写深度字段，NaN 表示盘口未取得
+
+查询用 np.memmap 打开时间范围覆盖到的分区，按市场编号筛选后在本进程内分桶降采样
+(每桶 min / max / last)，页面只拿到几百个点，不需要把整份历史读进内存。
+
+扫描进程与页面进程各自持有实例、写同一个目录：追加在 <root>/history.lock 的跨进程文件锁内进行，
+分配编号前先读入 markets.txt 中其他进程新写的名称，查询未命中时同样重读，编号在进程间保持一致。
+"""
+import contextlib
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:      # Windows
+    fcntl = None
+    import msvcrt
+
+DEFAULT_DIR = os.environ.get(
+    "ARB_HISTORY_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "history")
+)
+# poly/prob 两侧 yes/no 价格、策略 A (Poly Yes + Prob No) / B (Poly No + Prob Yes) 的成本与真实容量
+FIELDS = ("poly_yes", "poly_no", "prob_yes", "prob_no", "cost_a", "cost_b", "depth_a", "depth_b")
+PRICE_FIELDS = FIELDS[:6]
+KIND_PRICE = 1
+KIND_DEPTH = 2
+LOOKBACK_DAYS = 7        # 查询起点之前最多往回找几天的最后一个值，用于补齐第一个桶
+
+
+def partition_name(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%d")
+
+
+def arb_fields(arb):
+    """套利原始数据 -> 价格与成本字段；arb 为 None (无有效价格或市场已下架) 时全部为 NaN"""
+    if arb is None: return {f: np.nan for f in PRICE_FIELDS}
+    return {
+        "poly_yes": arb["poly_yes"], "poly_no": arb["poly_no"],
+        "prob_yes": arb["prob_yes"], "prob_no": arb["prob_no"],
+        "cost_a": arb["poly_yes"] + arb["prob_no"], "cost_b": arb["poly_no"] + arb["prob_yes"],
+    }
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    """跨进程的排他文件锁"""
+    with open(path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class SpreadHistory:
+    def __init__(self, root=DEFAULT_DIR):
+        self.root = root
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._names_path = os.path.join(root, "markets.txt")
+        self._lock_path = os.path.join(root, "history.lock")
+        self._ids = {}
+        self._names_read = 0     # 已读入的 markets.txt 字节数
+        self._names_count = 0    # 已读入的行数 (即下一个编号)
+        with self._lock:
+            self._reload_names()
+
+    def _reload_names(self):
+        """读入 markets.txt 中其他进程追加的名称 (调用方持有 self._lock)"""
+        if not os.path.exists(self._names_path): return
+        with open(self._names_path, "rb") as f:
+            f.seek(self._names_read)
+            data = f.read()
+        # 只处理完整的行，写了一半的行留到下次
+        data = data[:data.rfind(b"\n") + 1]
+        for line in data.decode("utf-8").splitlines():
+            self._ids.setdefault(line, self._names_count)
+            self._names_count += 1
+        self._names_read += len(data)
+
+    def _market_id(self, name, names_file):
+        market = self._ids.get(name)
+        if market is None:
+            market = self._ids[name] = self._names_count
+            line = (name.replace("\n", " ") + "\n").encode("utf-8")
+            names_file.write(line)
+            self._names_count += 1
+            self._names_read += len(line)
+        return market
+
+    def append(self, ts, records, kind=KIND_PRICE):
+        """records 为 [(市场名称, {字段: 值}), ...]；缺少的字段记为 NaN。返回写入条数"""
+        if not records: return 0
+        n = len(records)
+        columns = {f: np.full(n, np.nan, dtype="float32") for f in FIELDS}
+        markets = np.empty(n, dtype="uint32")
+        with self._lock, file_lock(self._lock_path):
+            # 其他进程可能已追加了名称：先读入，再在文件末尾分配新编号
+            self._reload_names()
+            with open(self._names_path, "ab") as names_file:
+                for i, (name, values) in enumerate(records):
+                    markets[i] = self._market_id(name, names_file)
+                    for field, value in values.items():
+                        if value is not None: columns[field][i] = value
+            part = os.path.join(self.root, partition_name(ts))
+            os.makedirs(part, exist_ok=True)
+            self._align(part)
+            # 先写字段列、最后写 ts：中途失败时读取按最短的列截断，不会读到半条记录
+            for field in FIELDS:
+                with open(os.path.join(part, f"{field}.f4"), "ab") as f:
+                    f.write(columns[field].tobytes())
+            with open(os.path.join(part, "market.u4"), "ab") as f:
+                f.write(markets.tobytes())
+            with open(os.path.join(part, "kind.u1"), "ab") as f:
+                f.write(np.full(n, kind, dtype="uint8").tobytes())
+            with open(os.path.join(part, "ts.f8"), "ab") as f:
+                f.write(np.full(n, ts, dtype="float64").tobytes())
+        return n
+
+    @staticmethod
+    def _columns():
+        return [(f"{f}.f4", 4) for f in FIELDS] + [("market.u4", 4), ("kind.u1", 1), ("ts.f8", 8)]
+
+    def _align(self, part):
+        """
+        上次追加中途失败会让各列长度不一：追加前 (已持有文件锁) 把所有列截断到共同的完整行数，
+        否则之后追加的记录在各列中的行号错位，整个分区都读不对。
+        """
+        sizes = {}
+        for name, width in self._columns():
+            file = os.path.join(part, name)
+            sizes[name] = (os.path.getsize(file) if os.path.exists(file) else 0, width)
+        rows = min(size // width for size, width in sizes.values())
+        for name, (size, width) in sizes.items():
+            if size != rows * width:
+                with open(os.path.join(part, name), "r+b") as f:
+                    f.truncate(rows * width)
+
+    def _read(self, part, market):
+        """返回分区内某市场的 (ts, kind, {字段: 数组})，按写入 (时间) 顺序"""
+        path = os.path.join(self.root, part)
+
+        def column(name, dtype):
+            file = os.path.join(path, name)
+            if not os.path.exists(file) or os.path.getsize(file) == 0: return np.empty(0, dtype=dtype)
+            return np.memmap(file, dtype=dtype, mode="r")
+
+        ts = column("ts.f8", "float64")
+        ids = column("market.u4", "uint32")
+        kinds = column("kind.u1", "uint8")
+        fields = {f: column(f"{f}.f4", "float32") for f in FIELDS}
+        n = min([len(ts), len(ids), len(kinds)] + [len(c) for c in fields.values()])
+        rows = np.flatnonzero(ids[:n] == market)
+        return ts[rows].copy(), kinds[rows].copy(), {f: c[rows].astype("float64") for f, c in fields.items()}
+
+    def _partitions(self, start, end):
+        day = datetime.fromtimestamp(start, timezone.utc).date()
+        last = datetime.fromtimestamp(end, timezone.utc).date()
+        while day <= last:
+            yield day.isoformat()
+            day += timedelta(days=1)
+
+    def query(self, name, start, end, buckets=200):
+        """
+        [start, end) 内某市场的降采样序列。返回 {"ts": 桶起点, "<field>_min" / "_max" / "_last": 数组}，
+        共 buckets 个桶；价格字段没有新记录的桶沿用上一个值，深度字段只在有观测的桶有值。
+        市场没有任何记录时返回 None。
+        """
+        with self._lock:
+            market = self._ids.get(name)
+            if market is None:
+                # 可能是其他进程 (如扫描进程) 在本实例创建后才写入的市场
+                self._reload_names()
+                market = self._ids.get(name)
+        if market is None or end <= start: return None
+        parts = [self._read(p, market) for p in self._partitions(start, end)
+                 if os.path.isdir(os.path.join(self.root, p))]
+        ts = np.concatenate([p[0] for p in parts]) if parts else np.empty(0)
+        kinds = np.concatenate([p[1] for p in parts]) if parts else np.empty(0, dtype="uint8")
+        values = {f: np.concatenate([p[2][f] for p in parts]) if parts else np.empty(0) for f in FIELDS}
+
+        # 起点之前最后一条价格记录，作为第一个桶的初值
+        carry = None
+        day = datetime.fromtimestamp(start, timezone.utc).date()
+        for back in range(LOOKBACK_DAYS + 1):
+            part = (day - timedelta(days=back)).isoformat()
+            if not os.path.isdir(os.path.join(self.root, part)): continue
+            p_ts, p_kinds, p_values = self._read(part, market)
+            seen = np.flatnonzero((p_ts < start) & (p_kinds == KIND_PRICE))
+            if len(seen):
+                carry = {f: p_values[f][seen[-1]] for f in PRICE_FIELDS}
+                break
+        if carry is None: carry = {f: np.nan for f in PRICE_FIELDS}
+
+        inside = (ts >= start) & (ts < end)
+        if not inside.any() and all(np.isnan(v) for v in carry.values()): return None
+        ts, kinds = ts[inside], kinds[inside]
+        width = (end - start) / buckets
+        bucket = np.minimum(((ts - start) / width).astype("int64"), buckets - 1)
+        result = {"ts": start + width * np.arange(buckets)}
+        for f in FIELDS:
+            v = values[f][inside]
+            # 价格字段取价格记录 (NaN 即无价格，会中断补齐)；深度字段取已取得盘口的深度记录
+            ok = kinds == KIND_PRICE if f in PRICE_FIELDS else (kinds == KIND_DEPTH) & ~np.isnan(v)
+            lo, hi, last = (np.full(buckets, np.nan) for _ in range(3))
+            seen = np.zeros(buckets, dtype=bool)
+            if ok.any():
+                b, v = bucket[ok], v[ok]
+                # 记录按时间追加，同一桶的记录连续：reduceat 求 min/max (忽略 NaN)，每段最后一条为 last
+                starts = np.flatnonzero(np.r_[True, b[1:] != b[:-1]])
+                ends = np.r_[starts[1:], len(b)] - 1
+                lo[b[starts]] = np.fmin.reduceat(v, starts)
+                hi[b[starts]] = np.fmax.reduceat(v, starts)
+                last[b[starts]] = v[ends]
+                seen[b[starts]] = True
+            if f in PRICE_FIELDS:
+                # 没有新记录的桶沿用上一个值 (只在变化时写入)；桶内第一条记录之前也仍是上一个值
+                prev = carry[f]
+                for i in range(buckets):
+                    if not seen[i]:
+                        lo[i] = hi[i] = last[i] = prev
+                        continue
+                    if not np.isnan(prev): lo[i], hi[i] = np.fmin(lo[i], prev), np.fmax(hi[i], prev)
+                    prev = last[i]
+            result[f"{f}_min"], result[f"{f}_max"], result[f"{f}_last"] = lo, hi, last
+        return result
+
+    def stats(self):
+        parts = sorted(p for p in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, p)))
+        size = sum(
+            os.path.getsize(os.path.join(self.root, p, f))
+            for p in parts for f in os.listdir(os.path.join(self.root, p))
+        )
+        records = sum(
+            os.path.getsize(os.path.join(self.root, p, "ts.f8")) // 8
+            for p in parts if os.path.exists(os.path.join(self.root, p, "ts.f8"))
+        )
+        with self._lock:
+            markets = len(self._ids)
+        return {"partitions": len(parts), "records": records, "markets": markets, "bytes": size}
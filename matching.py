@@ -0,0 +1,204 @@
+"""
+市场匹配引擎
+
+第一层：question.strip().lower() 完全相同 (原有的快速路径)。
+第二层：规范化后 (NFKC、去标点、合并空白) 相同。
+第三层：模糊匹配。用倒排索引按每个问题最稀有的几个词分块生成候选对，
+块内用 rapidfuzz.process.cdist 多核向量化打分；数字 (年份、价位等) 或方向词 (above / below、
+win / lose、not 等) 不一致的候选直接排除。模糊配对需人工确认 (catalog_store.confirm_pair) 后才参与套利扫描。
+
+已打分的候选对按 (poly id, prob id) 缓存，问题文本未变的市场之间不会重复打分。
+StreamingMatcher 在目录分页到达时先做前两层的增量匹配，供流水线刷新尽早定价、出表。
+"""
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+
+import numpy as np
+from rapidfuzz import fuzz
+from rapidfuzz.process import cdist
+
+FUZZY_CUTOFF = 92        # token_sort_ratio 阈值 (0-100)
+BLOCK_KEYS = 3           # 每个问题取最稀有的几个词作为分块键
+STOPWORDS = {
+    "will", "the", "a", "an", "of", "in", "on", "by", "to", "be", "for", "at",
+    "is", "and", "or", "before", "after", "than", "this", "that", "with",
+}
+
+# 方向 / 否定词：措辞几乎相同、只差其中一个词的两个问题意思相反 (如 above $3,000 与 below $3,000)
+POLARITY_WORDS = {
+    "above", "below", "over", "under", "higher", "lower", "more", "less", "fewer", "most", "least",
+    "max", "min", "maximum", "minimum", "exceed", "exceeds", "up", "down", "rise", "fall",
+    "increase", "decrease", "win", "wins", "won", "lose", "loses", "lost", "before", "after",
+    "not", "no", "never", "without", "t",    # "won't" / "doesn't" 规范化后拆出 "t"
+}
+
+_PUNCT = re.compile(r"[^\w\s]")
+_NUMBER = re.compile(r"\d+(?:[.,]\d+)*")
+
+
+def exact_key(question):
+    return question.strip().lower()
+
+
+def normalize(question):
+    text = unicodedata.normalize("NFKC", question).lower()
+    return " ".join(_PUNCT.sub(" ", text).split())
+
+
+def numbers(question):
+    return frozenset(_NUMBER.findall(unicodedata.normalize("NFKC", question)))
+
+
+def polarity(norm):
+    return frozenset(t for t in norm.split() if t in POLARITY_WORDS)
+
+
+def index_tokens(norm):
+    return {t for t in norm.split() if t not in STOPWORDS and (len(t) > 1 or t.isdigit())}
+
+
+def market_id(market):
+    return market.id or market.question
+
+
+class MatchEngine:
+    """
+    跨平台市场匹配；实例在多次刷新之间复用以保留打分缓存。
+    市场为 records.py 中的紧凑记录；match() 返回 [(poly_market, prob_market, score, tier), ...]，tier 为 exact / normalized / fuzzy。
+    """
+
+    def __init__(self, cutoff=FUZZY_CUTOFF):
+        self.cutoff = cutoff
+        self._lock = threading.Lock()
+        self._poly_norm = {}     # id -> 上次打分时的规范化问题
+        self._prob_norm = {}
+        self._scored = {}        # (poly id, prob id) -> 分数 (仅保存超过阈值的候选对)
+
+    def match(self, poly, prob):
+        with self._lock:
+            return self._match(poly, prob)
+
+    def _match(self, poly, prob):
+        poly_by_key = {exact_key(m.question): m for m in poly if m.question}
+        prob_by_key = {exact_key(m.question): m for m in prob if m.question}
+
+        pairs = []
+        # 第一层：完全相同
+        for key in poly_by_key.keys() & prob_by_key.keys():
+            pairs.append((poly_by_key.pop(key), prob_by_key.pop(key), 100.0, "exact"))
+
+        # 第二层：规范化后相同
+        poly_rest = {market_id(m): (m, normalize(m.question)) for m in poly_by_key.values()}
+        prob_rest = {market_id(m): (m, normalize(m.question)) for m in prob_by_key.values()}
+        prob_by_norm = {norm: pid for pid, (_, norm) in prob_rest.items()}
+        for pid, (m, norm) in list(poly_rest.items()):
+            qid = prob_by_norm.get(norm)
+            if qid is not None and qid in prob_rest:
+                pairs.append((m, prob_rest.pop(qid)[0], 100.0, "normalized"))
+                del poly_rest[pid]
+
+        # 第三层：模糊匹配，只对新出现或问题文本变化过的市场打分
+        dirty_poly = {pid for pid, (_, norm) in poly_rest.items() if self._poly_norm.get(pid) != norm}
+        dirty_prob = {qid for qid, (_, norm) in prob_rest.items() if self._prob_norm.get(qid) != norm}
+        scored = {
+            k: v for k, v in self._scored.items()
+            if k[0] in poly_rest and k[1] in prob_rest and k[0] not in dirty_poly and k[1] not in dirty_prob
+        }
+        poly_items = list(poly_rest.items())
+        prob_items = list(prob_rest.items())
+        scored.update(self._score_blocks(
+            [(pid, v) for pid, v in poly_items if pid in dirty_poly], prob_items))
+        scored.update(self._score_blocks(
+            [(pid, v) for pid, v in poly_items if pid not in dirty_poly],
+            [(qid, v) for qid, v in prob_items if qid in dirty_prob]))
+
+        # 贪心一对一分配：分数高者优先
+        used_poly, used_prob = set(), set()
+        for (pid, qid), score in sorted(scored.items(), key=lambda kv: kv[1], reverse=True):
+            if pid in used_poly or qid in used_prob: continue
+            used_poly.add(pid)
+            used_prob.add(qid)
+            pairs.append((poly_rest[pid][0], prob_rest[qid][0], score, "fuzzy"))
+
+        self._scored = scored
+        self._poly_norm = {pid: norm for pid, (_, norm) in poly_rest.items()}
+        self._prob_norm = {qid: norm for qid, (_, norm) in prob_rest.items()}
+        pairs.sort(key=lambda p: exact_key(p[0].question))
+        return pairs
+
+    def _score_blocks(self, poly_items, prob_items):
+        """poly_items / prob_items 为 [(id, (market, norm)), ...]；返回 {(poly id, prob id): score}"""
+        if not poly_items or not prob_items: return {}
+
+        # 倒排索引：词 -> prob 下标
+        index = defaultdict(list)
+        for j, (_, (_, norm)) in enumerate(prob_items):
+            for token in index_tokens(norm):
+                index[token].append(j)
+
+        # 每个 poly 问题按最稀有的几个词分块
+        blocks = defaultdict(list)
+        for i, (_, (_, norm)) in enumerate(poly_items):
+            keys = sorted((t for t in index_tokens(norm) if t in index), key=lambda t: len(index[t]))
+            for token in keys[:BLOCK_KEYS]:
+                blocks[token].append(i)
+
+        results = {}
+        for token, poly_idx in blocks.items():
+            prob_idx = index[token]
+            scores = cdist(
+                [poly_items[i][1][1] for i in poly_idx],
+                [prob_items[j][1][1] for j in prob_idx],
+                scorer=fuzz.token_sort_ratio, score_cutoff=self.cutoff, workers=-1,
+            )
+            for r, c in zip(*np.nonzero(scores)):
+                pid, (pm, p_norm) = poly_items[poly_idx[r]]
+                qid, (qm, q_norm) = prob_items[prob_idx[c]]
+                if (pid, qid) in results: continue
+                # 数字不一致 (如不同年份、不同价位) 的市场不是同一个市场
+                if numbers(pm.question) != numbers(qm.question): continue
+                # 方向词不一致 (above / below、win / lose、多一个 not) 的市场意思相反，配对会变成双倍敞口
+                if polarity(p_norm) != polarity(q_norm): continue
+                results[(pid, qid)] = float(scores[r, c])
+        return results
+
+
+class StreamingMatcher:
+    """
+    目录分页到达时的增量匹配：只做前两层 (完全相同 / 规范化后相同)，每次 add() 返回新产生的 [(poly, prob), ...]。
+    已配对的市场再次到达 (记录有更新) 时返回用新记录组成的配对，便于重新定价。
+    模糊层需要完整目录，目录抓取完成后仍由 MatchEngine 做一次完整匹配，以其结果为准。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index = {"poly": {}, "prob": {}}       # 匹配键 -> 尚未配对的市场
+        self._partner = {"poly": {}, "prob": {}}     # 市场 id -> 对面已配对的市场 id
+        self._latest = {"poly": {}, "prob": {}}      # 市场 id -> 最新记录
+
+    def add(self, venue, markets):
+        other = "prob" if venue == "poly" else "poly"
+        pairs = []
+        with self._lock:
+            for m in markets:
+                if not m.question: continue
+                mid = market_id(m)
+                self._latest[venue][mid] = m
+                partner = self._partner[venue].get(mid)
+                if partner is None:
+                    keys = (exact_key(m.question), "~" + normalize(m.question))
+                    for key in keys:
+                        candidate = self._index[other].get(key)
+                        if candidate is None or market_id(candidate) in self._partner[other]: continue
+                        partner = market_id(candidate)
+                        self._partner[venue][mid] = partner
+                        self._partner[other][partner] = mid
+                        break
+                    else:
+                        for key in keys: self._index[venue][key] = m
+                        continue
+                match = self._latest[other][partner]
+                pairs.append((m, match) if venue == "poly" else (match, m))
+        return pairs
@@ -0,0 +1,196 @@
+"""
+热路径埋点
+
+按接口 (方法 + host + path) 记录请求数、状态码、流量与延迟分位数 (p50/p95/p99)，
+按阶段 (目录分页、匹配、价格同步、深度扫描……) 记录耗时，并统计被吞掉的异常。
+可导出为 Prometheus 文本格式：写到文件 (ARB_METRICS_FILE，供 node_exporter textfile 收集)
+或由 serve() 在独立端口提供 /metrics。
+"""
+import os
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import numpy as np
+
+SAMPLE_SIZE = 2048           # 每个接口/阶段保留最近多少个延迟样本用于计算分位数
+QUANTILES = (0.5, 0.95, 0.99)
+METRICS_FILE = os.environ.get("ARB_METRICS_FILE")
+
+
+class LatencySummary:
+    """累计次数与总耗时，外加最近 SAMPLE_SIZE 个样本 (分位数只反映近期)"""
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.last = 0.0
+        self.samples = deque(maxlen=SAMPLE_SIZE)
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.last = seconds
+        self.samples.append(seconds)
+
+    def quantiles(self):
+        if not self.samples: return {q: 0.0 for q in QUANTILES}
+        values = np.quantile(np.fromiter(self.samples, dtype="float64"), QUANTILES)
+        return dict(zip(QUANTILES, values.tolist()))
+
+
+def endpoint_label(method, url):
+    parts = urlsplit(url)
+    return f"{method} {parts.netloc}{parts.path}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(**labels):
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+class Metrics:
+    def __init__(self, textfile=METRICS_FILE):
+        self.textfile = textfile
+        self._lock = threading.Lock()
+        self.requests = defaultdict(LatencySummary)     # endpoint -> 延迟
+        self.statuses = Counter()                       # (endpoint, status) -> 次数
+        self.bytes = Counter()                          # endpoint -> 响应字节数
+        self.stages = defaultdict(LatencySummary)       # stage -> 耗时
+        self.exceptions = Counter()                     # (where, 异常类型) -> 次数
+        self.last_exception = {}                        # (where, 异常类型) -> 最近一条消息
+        self.started_at = time.time()
+
+    # --- 记录 ---
+    def observe_response(self, resp, *args, **kwargs):
+        """requests 的 response hook：挂到共享 Session 上，所有 HTTP 请求自动计数"""
+        endpoint = endpoint_label(resp.request.method, resp.url)
+        nbytes = len(resp.content or b"")
+        with self._lock:
+            self.requests[endpoint].observe(resp.elapsed.total_seconds())
+            self.statuses[(endpoint, resp.status_code)] += 1
+            self.bytes[endpoint] += nbytes
+        return resp
+
+    def observe_stage(self, stage, seconds):
+        with self._lock:
+            self.stages[stage].observe(seconds)
+        self.write_textfile()
+
+    @contextmanager
+    def stage(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_stage(name, time.perf_counter() - t0)
+
+    def record_exception(self, where, exc):
+        key = (where, type(exc).__name__)
+        with self._lock:
+            self.exceptions[key] += 1
+            self.last_exception[key] = str(exc)[:200]
+
+    # --- 读取 ---
+    def snapshot(self):
+        """供页面诊断面板使用的普通 dict/list 结构"""
+        with self._lock:
+            endpoints = [
+                {
+                    "endpoint": ep, "count": s.count, "total": s.total,
+                    "bytes": self.bytes[ep], "quantiles": s.quantiles(),
+                    "statuses": {code: n for (e, code), n in self.statuses.items() if e == ep},
+                }
+                for ep, s in self.requests.items()
+            ]
+            stages = [
+                {"stage": name, "count": s.count, "last": s.last, "total": s.total, "quantiles": s.quantiles()}
+                for name, s in self.stages.items()
+            ]
+            exceptions = [
+                {"where": where, "type": kind, "count": n, "last": self.last_exception[(where, kind)]}
+                for (where, kind), n in self.exceptions.items()
+            ]
+        return {"endpoints": endpoints, "stages": stages, "exceptions": exceptions}
+
+    def prometheus_text(self):
+        snap = self.snapshot()
+        lines = [
+            "# HELP arb_http_request_seconds HTTP latency (time to response headers) by endpoint",
+            "# TYPE arb_http_request_seconds summary",
+        ]
+        for ep in snap["endpoints"]:
+            for q, v in ep["quantiles"].items():
+                lines.append(f"arb_http_request_seconds{_labels(endpoint=ep['endpoint'], quantile=q)} {v:.6f}")
+            lines.append(f"arb_http_request_seconds_sum{_labels(endpoint=ep['endpoint'])} {ep['total']:.6f}")
+            lines.append(f"arb_http_request_seconds_count{_labels(endpoint=ep['endpoint'])} {ep['count']}")
+        lines += ["# HELP arb_http_responses_total HTTP responses by endpoint and status code",
+                  "# TYPE arb_http_responses_total counter"]
+        for ep in snap["endpoints"]:
+            for code, n in sorted(ep["statuses"].items()):
+                lines.append(f"arb_http_responses_total{_labels(endpoint=ep['endpoint'], status=code)} {n}")
+        lines += ["# HELP arb_http_response_bytes_total Response body bytes by endpoint",
+                  "# TYPE arb_http_response_bytes_total counter"]
+        for ep in snap["endpoints"]:
+            lines.append(f"arb_http_response_bytes_total{_labels(endpoint=ep['endpoint'])} {ep['bytes']}")
+        lines += ["# HELP arb_stage_seconds Duration of refresh / scan stages",
+                  "# TYPE arb_stage_seconds summary"]
+        for st in snap["stages"]:
+            for q, v in st["quantiles"].items():
+                lines.append(f"arb_stage_seconds{_labels(stage=st['stage'], quantile=q)} {v:.6f}")
+            lines.append(f"arb_stage_seconds_sum{_labels(stage=st['stage'])} {st['total']:.6f}")
+            lines.append(f"arb_stage_seconds_count{_labels(stage=st['stage'])} {st['count']}")
+        lines += ["# HELP arb_swallowed_exceptions_total Exceptions caught and handled without surfacing",
+                  "# TYPE arb_swallowed_exceptions_total counter"]
+        for ex in snap["exceptions"]:
+            lines.append(f"arb_swallowed_exceptions_total{_labels(where=ex['where'], type=ex['type'])} {ex['count']}")
+        lines += ["# TYPE arb_process_start_time_seconds gauge", f"arb_process_start_time_seconds {self.started_at:.3f}"]
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self):
+        """
+        配置了 textfile 时原子写入 (先写临时文件再替换)。多个线程 (如两边目录的抓取阶段) 可能同时结束，
+        每次写入使用独立的临时文件，不会写进同一个文件里互相穿插。
+        """
+        if not self.textfile: return
+        tmp = None
+        try:
+            fd, tmp = tempfile.mkstemp(
+                prefix=os.path.basename(self.textfile) + ".", suffix=".tmp",
+                dir=os.path.dirname(os.path.abspath(self.textfile)),
+            )
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(self.prometheus_text())
+            os.replace(tmp, self.textfile)
+        except OSError:
+            if tmp is not None and os.path.exists(tmp): os.remove(tmp)
+
+    def serve(self, port, host="0.0.0.0"):
+        """在后台线程提供 GET /metrics，返回 HTTP server"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus_text().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        httpd = ThreadingHTTPServer((host, port), Handler)
+        httpd.daemon_threads = True
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        return httpd
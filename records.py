@@ -0,0 +1,120 @@
+"""
+紧凑市场记录
+
+接口返回的每个市场有几十个字段，实际只用到问题、结果名称、token id、价格、流动性与成交量。
+分页抓取时每条市场立即投影为 __slots__ 记录，clobTokenIds / outcomePrices / outcomes
+这些 JSON 字符串只在入库时解析一次；原始 dict 随页面一起释放。
+记录创建后视为只读，可在会话、后台线程之间直接共享。
+
+JSON 用 orjson 解析 (明显快于标准库，已列入 requirements.txt)；未安装时回退到 json。
+"""
+import json
+
+try:
+    import orjson
+    loads = orjson.loads
+except ImportError:
+    loads = json.loads
+
+
+def safe_float(val):
+    try:
+        if val is None or val == "": return 0.0
+        return float(val)
+    except (TypeError, ValueError): return 0.0
+
+
+def parse_list(value):
+    """JSON 字符串或 list -> list；无法解析时返回 None"""
+    if isinstance(value, list): return value
+    if isinstance(value, str):
+        try:
+            data = loads(value)
+            if isinstance(data, list): return data
+        except ValueError: pass
+    return None
+
+
+_OUTCOMES = {}   # 结果名称元组驻留表：绝大多数市场共用同一个 ("Yes", "No")
+
+
+def parse_outcomes(value):
+    data = parse_list(value)
+    outcomes = tuple(data) if data and len(data) >= 2 else ("Yes", "No")
+    try:
+        return _OUTCOMES.setdefault(outcomes, outcomes)
+    except TypeError:
+        return outcomes
+
+
+class PolyMarket:
+    __slots__ = ("id", "question", "outcomes", "token_ids", "yes_token", "no_token", "prices",
+                 "liquidity", "volume", "updated_at", "active", "closed")
+
+    @classmethod
+    def from_api(cls, m):
+        self = cls()
+        self.id = str(m.get("id") or m.get("question") or "")
+        self.question = m.get("question")
+        self.outcomes = parse_outcomes(m.get("outcomes"))
+        self.token_ids = tuple(parse_list(m.get("clobTokenIds")) or ())
+        self.yes_token = self.no_token = None
+        if len(self.token_ids) == len(self.outcomes):
+            for token, name in zip(self.token_ids, self.outcomes):
+                if name == "Yes": self.yes_token = token
+                if name == "No": self.no_token = token
+        elif len(self.token_ids) >= 2:
+            self.yes_token, self.no_token = self.token_ids[0], self.token_ids[1]
+        # 价格无法解析时为 None (页面显示 Err)；入库时记为 null，读回仍为 None
+        prices = m.get("outcomePrices", [])
+        try:
+            self.prices = None if prices is None else tuple(float(p) for p in parse_list(prices) or ())
+        except (TypeError, ValueError):
+            self.prices = None
+        self.liquidity = safe_float(m.get("liquidity", 0))
+        # 优先使用 24h 成交量，缺失时用总成交量
+        self.volume = safe_float(m.get("volume24hr", 0)) or safe_float(m.get("volume", 0))
+        self.updated_at = m.get("updatedAt")
+        self.active = m.get("active")
+        self.closed = m.get("closed")
+        return self
+
+    def to_payload(self):
+        """入库格式 (字段名与接口一致，from_api 可直接读回)"""
+        return {
+            "id": self.id, "question": self.question, "outcomes": self.outcomes,
+            "clobTokenIds": self.token_ids, "outcomePrices": self.prices,
+            "liquidity": self.liquidity, "volume24hr": self.volume, "updatedAt": self.updated_at,
+        }
+
+
+class ProbMarket:
+    __slots__ = ("id", "question", "outcomes", "yes_token", "no_token",
+                 "liquidity", "volume", "updated_at", "active", "closed")
+
+    @classmethod
+    def from_api(cls, m):
+        self = cls()
+        self.id = str(m.get("id") or m.get("question") or "")
+        self.question = m.get("question")
+        self.outcomes = parse_outcomes(m.get("outcomes"))
+        tokens = m.get("tokens") or []
+        self.yes_token = next((t["token_id"] for t in tokens if t.get("outcome") == "Yes"), None)
+        self.no_token = next((t["token_id"] for t in tokens if t.get("outcome") == "No"), None)
+        self.liquidity = safe_float(m.get("liquidity", 0))
+        self.volume = safe_float(m.get("volume24hr", 0))
+        self.updated_at = m.get("updatedAt")
+        self.active = m.get("active")
+        self.closed = m.get("closed")
+        return self
+
+    def to_payload(self):
+        tokens = [{"token_id": t, "outcome": name}
+                  for t, name in ((self.yes_token, "Yes"), (self.no_token, "No")) if t]
+        return {
+            "id": self.id, "question": self.question, "outcomes": self.outcomes, "tokens": tokens,
+            "liquidity": self.liquidity, "volume24hr": self.volume,
+        }
+
+
+RECORD_TYPES = {"poly": PolyMarket, "prob": ProbMarket}
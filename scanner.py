@@ -0,0 +1,139 @@
+"""
+后台扫描进程
+
+定时同步两边目录、匹配市场、同步价格，并可为收益最高的候选沿完整卖盘计算可成交容量；
+结果作为快照写入本地目录库 (catalog_store)，所有 Streamlit 会话只读取最新快照。
+开启 --jsonl 时每轮把套利机会按行写到 stdout，供告警系统消费；加 --changes 时只写相对上一轮的
+机会变更 (出现 / 消失 / 成本移动)。价格未变的机会在 DEPTH_MAX_AGE 内复用上一轮的深度结果；
+价格变化与新算出的深度写入价差历史 (history.py)，页面可查看单个市场的价差走势；
+--metrics-port 提供 Prometheus 格式的 /metrics (各接口/阶段的请求数、延迟分位数、异常计数)。
+
+    python scanner.py --interval 30 --depth 200 --jsonl >> opportunities.jsonl
+"""
+import argparse
+import json
+import sys
+import time
+
+import core
+from catalog_store import CatalogStore
+
+DEPTH_MAX_AGE = 120      # 价格未变的机会最多复用多久之前的深度结果 (秒)
+
+
+def scan_once(store, min_profit=0.0, depth_limit=0, depth_state=None):
+    """
+    执行一轮扫描并发布快照；目录或价格拉取失败 (无法生成完整快照) 时保留上一份快照并返回 None。
+    depth_state 为跨轮复用的 {"poly_prob": (容量五元组, 计算时间)}：只为新出现、成本移动、
+    尚无结果或结果过期的机会查询盘口。
+    返回 (created_at, candidates, depth, changes)，
+    depth 为 "poly_prob" -> (总投入, Poly端投入, Prob端投入, 份数, 预期利润)，
+    changes 为机会变更流 (delta.py)。
+    """
+    poly, prob, errors = core.sync_catalogs(store)
+    for msg in errors: print(msg, file=sys.stderr)
+    # 失败的一侧由本地库补齐 (poly / prob 不会为空)，但其中的价格已不是最新，不以新时间发布快照
+    if errors:
+        return None
+
+    snap = core.process_markets(poly, prob, confirmed=store.confirmed_pairs())
+    if snap is None:
+        print("Probable 价格拉取失败", file=sys.stderr)
+        return None
+    threshold_cost = 1.0 - min_profit / 100.0
+    candidates = core.scan_arbitrage(core.build_arb_frame(snap["arb"]), threshold_cost)
+    depth, ladders, depth_records = {}, {}, []
+    if depth_limit:
+        if depth_state is None: depth_state = {}
+        top = candidates.head(depth_limit)
+        pairs = list(zip(top["poly_side_id"], top["prob_side_id"]))
+        moved = {f"{c['poly_token_id']}_{c['prob_token_id']}" for c in snap["changes"] if c["event"] != "disappeared"}
+        now = time.time()
+        stale = [
+            i for i, (poly_id, prob_id) in enumerate(pairs)
+            if (key := f"{poly_id}_{prob_id}") in moved or key not in depth_state or now - depth_state[key][1] > DEPTH_MAX_AGE
+        ]
+        capacities = core.calculate_arb_capacity_batch(
+            [pairs[i] for i in stale], priorities=top["raw_profit"].to_numpy()[stale],
+            deadline=time.monotonic() + core.DEPTH_DEADLINE, threshold_cost=threshold_cost) if stale else []
+        for i, capacity in zip(stale, capacities):
+            poly_id, prob_id = pairs[i]
+            depth[f"{poly_id}_{prob_id}"] = capacity
+            # 未取得盘口的不缓存，下一轮重试
+            if capacity[0] is not None:
+                depth_state[f"{poly_id}_{prob_id}"] = (capacity, now)
+                depth_records.append((top["question"].iat[i], {f"depth_{top['strat'].iat[i].lower()}": capacity[0]}))
+        for poly_id, prob_id in pairs:
+            key = f"{poly_id}_{prob_id}"
+            if key not in depth and key in depth_state: depth[key] = depth_state[key][0]
+        # 只保留仍在前 N 名中的结果
+        for key in depth_state.keys() - depth.keys():
+            del depth_state[key]
+        # 发布按 token 的卖盘，页面据此预热自己的盘口缓存
+        ladders = core.get_book_cache().export(
+            [f"poly:{p}" for p, _ in pairs if p] + [f"prob:{q}" for _, q in pairs if q])
+    created_at = store.save_snapshot(snap["rows"], snap["arb"], snap["stats"], ladders, snap["changes"])
+    core.record_spread_history(created_at, snap["updated"], depth_records)
+    return created_at, candidates, depth, snap["changes"]
+
+
+def opportunity_records(candidates, depth, ts):
+    for row in candidates.itertuples(index=False):
+        capacity = depth.get(f"{row.poly_side_id}_{row.prob_side_id}")
+        yield {
+            "ts": ts,
+            "question": row.question,
+            "strategy": row.strat,
+            "strategy_name": row.strategy_name,
+            "cost": float(row.cost),
+            "profit": float(row.raw_profit),
+            "poly_token_id": row.poly_side_id,
+            "prob_token_id": row.prob_side_id,
+            "real_capacity": capacity[0] if capacity else None,
+            "poly_capacity": capacity[1] if capacity else None,
+            "prob_capacity": capacity[2] if capacity else None,
+            "shares": capacity[3] if capacity else None,
+            "expected_profit": capacity[4] if capacity else None,
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Polymarket vs Probable 后台扫描进程")
+    parser.add_argument("--interval", type=float, default=30, help="扫描间隔 (秒)")
+    parser.add_argument("--once", action="store_true", help="只扫描一轮后退出")
+    parser.add_argument("--min-profit", type=float, default=0.0, help="最小利润率 (%%)")
+    parser.add_argument("--depth", type=int, default=0, help="为收益最高的前 N 个机会计算多档容量 (0 表示不计算)")
+    parser.add_argument("--jsonl", action="store_true", help="把套利机会按行写到 stdout")
+    parser.add_argument("--changes", action="store_true", help="配合 --jsonl：只写机会变更 (appeared / disappeared / moved)")
+    parser.add_argument("--db", default=None, help="目录库路径 (默认与页面共用)")
+    parser.add_argument("--metrics-port", type=int, default=0, help="在该端口提供 Prometheus /metrics (0 表示不开启)")
+    args = parser.parse_args(argv)
+
+    store = CatalogStore(args.db) if args.db else core.get_catalog_store()
+    if args.metrics_port: core.get_metrics().serve(args.metrics_port)
+    depth_state = {}
+    while True:
+        started = time.time()
+        if not args.once: store.set_heartbeat(args.interval)
+        try:
+            result = scan_once(store, args.min_profit, args.depth, depth_state)
+        except Exception as e:
+            print(f"扫描失败: {e}", file=sys.stderr)
+            result = None
+        if result is not None:
+            created_at, candidates, depth, changes = result
+            print(f"快照已发布: {len(candidates)} 个机会, 变更 {len(changes)} 条, 耗时 {time.time() - started:.1f}s", file=sys.stderr)
+            if args.jsonl:
+                records = ({"ts": created_at, **c} for c in changes) if args.changes else \
+                    opportunity_records(candidates, depth, created_at)
+                for record in records:
+                    sys.stdout.write(json.dumps(record, ensure_ascii=False) + "\n")
+                sys.stdout.flush()
+        if args.once:
+            return 0 if result is not None else 1
+        store.set_heartbeat(args.interval)
+        time.sleep(max(0.0, args.interval - (time.time() - started)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
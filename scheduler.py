@@ -0,0 +1,156 @@
+"""
+限流感知的请求调度
+
+所有 HTTP 请求经过 RequestScheduler：每个 host 一个令牌桶控制请求速率；
+收到 429 时按 Retry-After (缺省时指数退避) 暂停该 host 并把速率减半，之后逐步恢复 (AIMD)；
+429 / 5xx / 连接错误 / 超时按带抖动的指数退避重试。可传入 deadline (time.monotonic 时刻)，
+到期前无法完成的等待或重试直接放弃，抛出 DeadlineExceeded。
+"""
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+
+DEFAULT_RATE = float(os.environ.get("ARB_HOST_RATE", "20"))   # 未单独配置的 host 每秒请求数上限
+# 已知 host 的速率上限 (req/s)，按公开文档的限额留出余量
+HOST_RATES = {
+    "gamma-api.polymarket.com": 25.0,
+    "clob.polymarket.com": 40.0,
+}
+MIN_RATE = 1.0
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.25          # 秒
+BACKOFF_CAP = 8.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+def retry_after_seconds(resp):
+    """解析 Retry-After (秒数或 HTTP 日期)；没有或无法解析时返回 None"""
+    value = resp.headers.get("Retry-After")
+    if not value: return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff(attempt):
+    """全抖动指数退避"""
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+class HostLimiter:
+    """令牌桶 + AIMD：429 时速率减半并暂停到 Retry-After，成功时线性恢复到上限"""
+    def __init__(self, rate=DEFAULT_RATE):
+        self.max_rate = rate
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+        self.throttled = 0       # 收到的 429 次数
+        self.retries = 0
+
+    def acquire(self, deadline=None):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            if deadline is not None and now + wait > deadline:
+                raise DeadlineExceeded("deadline reached while waiting for rate limit")
+            time.sleep(min(wait, 0.5))
+
+    def on_throttled(self, pause):
+        with self.lock:
+            self.throttled += 1
+            now = time.monotonic()
+            # 同一暂停窗口内并发收到的多个 429 只减速一次
+            if now >= self.paused_until:
+                self.rate = max(MIN_RATE, self.rate / 2)
+                self.tokens = min(self.tokens, self.rate)
+            self.paused_until = max(self.paused_until, now + pause)
+
+    def on_success(self):
+        with self.lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 50)
+
+
+class RequestScheduler:
+    def __init__(self, default_rate=DEFAULT_RATE, host_rates=None, max_retries=MAX_RETRIES):
+        self.default_rate = default_rate
+        self.host_rates = HOST_RATES if host_rates is None else host_rates
+        self.max_retries = max_retries
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def limiter(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._limiters:
+                self._limiters[host] = HostLimiter(self.host_rates.get(host, self.default_rate))
+            return self._limiters[host]
+
+    def request(self, session, method, url, deadline=None, max_retries=None, **kwargs):
+        """
+        按 host 限流后发出请求，429 / 5xx / 网络错误自动重试。
+        重试用尽时返回最后一次响应 (状态码由调用方判断)，若最后一次是异常则抛出。
+        """
+        limiter = self.limiter(url)
+        retries = self.max_retries if max_retries is None else max_retries
+        for attempt in range(retries + 1):
+            resp = None
+            limiter.acquire(deadline)
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0: raise DeadlineExceeded(f"deadline reached before {method} {url}")
+                kwargs["timeout"] = min(kwargs.get("timeout") or remaining, remaining)
+            try:
+                resp = session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= retries: raise
+                wait = backoff(attempt)
+            else:
+                if resp.status_code not in RETRY_STATUSES:
+                    limiter.on_success()
+                    return resp
+                if attempt >= retries: return resp
+                if resp.status_code == 429:
+                    retry_after = retry_after_seconds(resp)
+                    wait = (retry_after if retry_after is not None else backoff(attempt + 1)) + backoff(0)
+                    limiter.on_throttled(wait)
+                else:
+                    wait = backoff(attempt)
+            if deadline is not None and time.monotonic() + wait > deadline:
+                raise DeadlineExceeded(f"deadline reached while retrying {method} {url}")
+            with limiter.lock:
+                limiter.retries += 1
+            # 429 的暂停由令牌桶统一执行 (同 host 的其他请求也一起等待)，这里不再重复睡眠
+            if resp is None or resp.status_code != 429: time.sleep(wait)
+
+    def stats(self):
+        with self._lock:
+            limiters = dict(self._limiters)
+        now = time.monotonic()
+        return [
+            {"host": host, "rate": lim.rate, "max_rate": lim.max_rate, "throttled": lim.throttled,
+             "retries": lim.retries, "paused_for": max(0.0, lim.paused_until - now)}
+            for host, lim in limiters.items()
+        ]